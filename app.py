@@ -1,19 +1,43 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
+import io
+import re
+import calendar
+import json
+import sqlite3
+import mimetypes
+import time
+import uuid
+import gzip
+import hashlib
+import hmac
+import zipfile
+import functools
+import importlib
+import itertools
+import multiprocessing
+from collections import OrderedDict, Counter
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, Response, g, make_response, abort, has_request_context, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+import click
+from sqlalchemy import exists, inspect, text, tuple_, event, table as sa_table, column as sa_column, select, union_all, literal, case
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects import sqlite as sqlite_dialect, postgresql as postgresql_dialect
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.orm import joinedload, contains_eager, aliased, Session
+from datetime import date, datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-import smtplib
-from email.mime.text import MIMEText
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet
+from werkzeug.middleware.proxy_fix import ProxyFix
+from PIL import Image as PILImage, ImageOps
 from dotenv import load_dotenv
 
+try:
+    from .rental_pdfs import build_rental_pdf, build_combined_rental_pdf
+except ImportError:  # loaded as a top-level module (flask CLI, python app.py)
+    from rental_pdfs import build_rental_pdf, build_combined_rental_pdf
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 app = Flask(
@@ -31,12 +55,10 @@ os.makedirs(instance_folder, exist_ok=True)
 
 load_dotenv()  # loads variables from .env
 
-app = Flask(__name__)
-app.secret_key = os.getenv("FLASK_SECRET", "supersecretkey")
+# Flask's logger otherwise inherits WARNING outside debug mode, hiding start-up notices
+app.logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
 
 # Choose local or online DB
-import os
-
 # Detect if running on Render (DATABASE_URL is provided by Render automatically)
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -50,6 +72,29 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Engine profile. Pools are per worker process, so Postgres sees up to
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 10))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # below the server/proxy idle timeout
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 30000))  # 0 disables
+# SQLite: WAL lets readers run alongside the single writer; NORMAL only syncs at
+# checkpoints, which is durable across application crashes (not power loss) in WAL mode
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))  # wait for the write lock
+
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith("sqlite"):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,  # replace connections the server or a proxy closed while idle
+        "connect_args": {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"},
+    }
+
 # Use a secure secret in production
 app.secret_key = os.getenv("FLASK_SECRET", "your-secret-key")
 
@@ -72,6 +117,18 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 db = SQLAlchemy()
 db.init_app(app)
 
+@event.listens_for(Engine, "connect")
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys (and so ON DELETE CASCADE) unless asked per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS:d}")
+        # The journal mode is stored in the database file; in-memory databases keep "memory"
+        cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        cursor.close()
+
 # expose datetime utilities to Jinja
 app.jinja_env.globals['datetime'] = datetime
 
@@ -111,6 +168,253 @@ def time_ago(dt):
 app.jinja_env.filters["timeago"] = time_ago
 app.jinja_env.globals["time_ago"] = time_ago
 
+# ------------------------
+# FEED PAGINATION HELPERS
+# ------------------------
+FEED_PAGE_SIZE = int(os.getenv("FEED_PAGE_SIZE", 24))
+
+def encode_feed_cursor(listing):
+    # "<created_at iso>_<id>" of the last card on the page
+    return f"{listing.created_at.isoformat()}_{listing.id}"
+
+def decode_feed_cursor(cursor):
+    # Returns (created_at, id) or None if the cursor is missing/invalid
+    if not cursor:
+        return None
+    created, _, listing_id = cursor.rpartition("_")
+    try:
+        return datetime.fromisoformat(created), int(listing_id)
+    except ValueError:
+        return None
+
+# ------------------------
+# IMAGE DERIVATIVES
+# ------------------------
+# Uploads are re-encoded into these widths, as WebP plus a JPEG (or PNG when
+# the image has transparency) fallback, named "<content hash>_<variant>.<ext>".
+IMAGE_VARIANTS = {"thumb": 160, "card": 480, "full": 1280}
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+DERIVATIVE_RE = re.compile(r"^(?P<prefix>.*?)(?P<digest>[0-9a-f]{16})_full\.(?P<ext>jpg|png)$")
+# Any variant of any format, e.g. "<digest>_thumb.webp"
+DERIVATIVE_FILE_RE = re.compile(
+    rf"^(?P<digest>[0-9a-f]{{16}})_(?:{'|'.join(IMAGE_VARIANTS)})\.(?:webp|jpg|png)$"
+)
+INVALID_IMAGE_ERRORS = (OSError, PILImage.DecompressionBombError)
+
+def _write_atomic(path, data):
+    # Readers only ever see a complete file, even with concurrent writers
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def save_image_derivatives(source, folder):
+    """Resize and recompress an uploaded image into folder; return the stored filename.
+
+    The returned name is the full-size fallback; the other variants sit next to
+    it and are found by image_variants(). Metadata is dropped by re-encoding.
+    """
+    raw = source.read()
+    digest = hashlib.sha256(raw).hexdigest()[:16]
+    with PILImage.open(io.BytesIO(raw)) as original:
+        original.load()
+        img = ImageOps.exif_transpose(original)
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    if has_alpha:
+        img = img.convert("RGBA")
+        # Screenshots are often RGBA but fully opaque; those compress far better as JPEG
+        has_alpha = img.getchannel("A").getextrema()[0] < 255
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    fallback_ext = "png" if has_alpha else "jpg"
+
+    for variant, width in IMAGE_VARIANTS.items():
+        resized = img
+        if img.width > width:
+            resized = img.resize((width, max(1, round(img.height * width / img.width))), PILImage.LANCZOS)
+        for ext in ("webp", fallback_ext):
+            path = os.path.join(folder, f"{digest}_{variant}.{ext}")
+            if os.path.exists(path):
+                continue  # identical upload already processed
+            buf = io.BytesIO()
+            if ext == "webp":
+                resized.save(buf, "WEBP", quality=IMAGE_QUALITY, method=4)
+            elif ext == "jpg":
+                resized.save(buf, "JPEG", quality=IMAGE_QUALITY, optimize=True, progressive=True)
+            else:
+                resized.save(buf, "PNG", optimize=True)
+            _write_atomic(path, buf.getvalue())
+    return f"{digest}_full.{fallback_ext}"
+
+def image_variants(path):
+    """URLs for an image under static/: a fallback src plus srcsets when derivatives exist."""
+    match = DERIVATIVE_RE.match(path or "")
+    if not match:
+        return {"src": url_for("static", filename=path), "srcset": "", "webp_srcset": ""}
+    prefix, digest, ext = match.group("prefix", "digest", "ext")
+
+    def srcset(fmt):
+        return ", ".join(
+            f"{url_for('static', filename=f'{prefix}{digest}_{variant}.{fmt}')} {width}w"
+            for variant, width in IMAGE_VARIANTS.items()
+        )
+
+    return {
+        "src": url_for("static", filename=f"{prefix}{digest}_card.{ext}"),
+        "srcset": srcset(ext),
+        "webp_srcset": srcset("webp"),
+    }
+
+app.jinja_env.globals["image_variants"] = image_variants
+
+# ------------------------
+# STATIC ASSETS
+# ------------------------
+# url_for("static", ...) appends a content hash (?v=...), so asset URLs change
+# whenever the file does and browsers may cache them forever. Text assets are
+# precompressed once into instance/static_compressed and served as-is.
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 365 * 24 * 3600))
+STATIC_COMPRESSED_FOLDER = os.path.join(instance_folder, "static_compressed")
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html", ".xml"}
+HTML_COMPRESS_MIN_BYTES = int(os.getenv("HTML_COMPRESS_MIN_BYTES", 1024))
+HTML_COMPRESS_LEVEL = int(os.getenv("HTML_COMPRESS_LEVEL", 6))
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+_fingerprints = {}  # absolute path -> ((mtime_ns, size), digest)
+_fingerprints_lock = threading.Lock()
+
+def asset_fingerprint(filename):
+    """Short content hash of a file under static/, or None if it does not exist."""
+    path = os.path.join(app.static_folder, filename)
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _fingerprints.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()[:12]
+    with _fingerprints_lock:
+        _fingerprints[path] = (stamp, digest)
+    return digest
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint != "static" or "v" in values:
+        return
+    filename = values.get("filename") or ""
+    if DERIVATIVE_FILE_RE.match(os.path.basename(filename)):
+        return  # derivative names already contain their content hash
+    digest = asset_fingerprint(filename)
+    if digest:
+        values["v"] = digest
+
+def _compressed_path(filename, digest, encoding):
+    return os.path.join(STATIC_COMPRESSED_FOLDER, f"{filename}.{digest}.{encoding}")
+
+def precompress_static_assets():
+    """Write gzip (and brotli, if installed) copies of every text asset; returns how many were built."""
+    built = 0
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            filename = os.path.relpath(os.path.join(root, name), app.static_folder).replace(os.sep, "/")
+            digest = asset_fingerprint(filename)
+            encoders = {"gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                encoders["br"] = lambda data: brotli.compress(data, quality=11)
+            data = None
+            for encoding, encode in encoders.items():
+                target = _compressed_path(filename, digest, encoding)
+                if os.path.exists(target):
+                    continue
+                if data is None:
+                    with open(os.path.join(root, name), "rb") as f:
+                        data = f.read()
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                _write_atomic(target, encode(data))
+                built += 1
+    return built
+
+def _accepted_encodings():
+    accepted = request.accept_encodings
+    return [encoding for encoding in ("br", "gzip") if accepted[encoding]]
+
+def serve_static(filename):
+    """Static file view: immutable caching for fingerprinted URLs, precompressed text assets."""
+    digest = None
+    if DERIVATIVE_FILE_RE.match(os.path.basename(filename)):
+        immutable = True
+    else:
+        digest = asset_fingerprint(filename)
+        immutable = digest is not None and request.args.get("v") == digest
+
+    response = None
+    if digest and os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        for encoding in _accepted_encodings():
+            path = _compressed_path(filename, digest, "gz" if encoding == "gzip" else encoding)
+            if os.path.exists(path):
+                response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+                response.headers["Content-Encoding"] = encoding
+                break
+        if response is None:
+            response = app.send_static_file(filename)
+        response.vary.add("Accept-Encoding")
+    else:
+        response = app.send_static_file(filename)
+
+    if immutable and response.status_code in (200, 304):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+app.view_functions["static"] = serve_static
+
+@app.after_request
+def compress_html(response):
+    """Compress dynamic HTML above HTML_COMPRESS_MIN_BYTES for clients that accept it."""
+    if (
+        response.mimetype != "text/html"
+        or response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < HTML_COMPRESS_MIN_BYTES:
+        return response
+    for encoding in _accepted_encodings():
+        if encoding == "br" and brotli is not None:
+            response.set_data(brotli.compress(data, quality=4))
+        elif encoding == "gzip":
+            response.set_data(gzip.compress(data, compresslevel=HTML_COMPRESS_LEVEL))
+        else:
+            continue
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)  # same content, different bytes
+        break
+    return response
+
+@app.cli.command("build-static")
+def build_static_command():
+    """Precompress static text assets (also done at startup unless STATIC_PRECOMPRESS=0)."""
+    print(f"Built {precompress_static_assets()} compressed asset(s) in {STATIC_COMPRESSED_FOLDER}.")
+
 # ------------------------
 # MODELS
 # ------------------------
@@ -123,49 +427,2329 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    # Delete all listings if user is deleted
-    listings = db.relationship("Listing", backref="user", cascade="all, delete-orphan")
+    # Delete all listings if user is deleted; the database cascades, so they are never loaded for it
+    listings = db.relationship("Listing", backref="user", cascade="all, delete-orphan", passive_deletes=True)
 
 class Listing(db.Model):
+    __table_args__ = (
+        # Home feed: ORDER BY created_at DESC, id DESC with a (created_at, id) cursor
+        db.Index("ix_listing_created_at_id", "created_at", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     description = db.Column(db.Text, nullable=False)
     price = db.Column(db.Float, nullable=False)
     image = db.Column(db.String(300), default="default_listing.png")
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Denormalized: True while the listing has an approved request (see sync_rental_state)
+    is_rented = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false(), index=True)
 
     # Delete all rent requests if listing is deleted
     requests = db.relationship(
         "RentRequest",
         backref="parent_listing",   # <-- renamed to avoid conflict
-        cascade="all, delete-orphan"
+        cascade="all, delete-orphan",
+        passive_deletes=True
     )
 
 class RentRequest(db.Model):
+    __table_args__ = (
+        # view_listing: "does this renter already have a request for this listing?"
+        db.Index("ix_rent_request_listing_renter", "listing_id", "renter_id"),
+        # Overlap checks, the availability calendar and rental state sync:
+        # listing + status, then a range on start_date with end_date read from the index
+        db.Index("ix_rent_request_listing_status_dates", "listing_id", "status", "start_date", "end_date"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    days = db.Column(db.Integer, nullable=False)
+    # The booking covers [start_date, end_date): end_date is the return day
+    start_date = db.Column(db.Date)
+    end_date = db.Column(db.Date)
+    days = db.Column(db.Integer, nullable=False)  # end_date - start_date, kept for pricing and stats
     description = db.Column(db.Text)
     status = db.Column(db.String(50), default="Pending")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    listing = db.relationship('Listing', backref='rent_requests', lazy=True)
-    listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'))
-    renter_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    listing = db.relationship('Listing', backref=db.backref('rent_requests', passive_deletes="all"), lazy=True)
+    listing_id = db.Column(db.Integer, db.ForeignKey('listing.id', ondelete="CASCADE"))
+    # A deleted renter's requests stay in the owner's history as "N/A"
+    renter_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="SET NULL"), index=True)
 
     # relationships
     renter = db.relationship("User")
     # ⚠️ removed duplicate `listing = db.relationship(...)`
 
+class Job(db.Model):
+    """Persistent unit of background work, claimed and run by JobWorker."""
+    __table_args__ = (
+        db.Index("ix_job_status_run_after", "status", "run_after"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    target = db.Column(db.String(100), index=True)  # e.g. "listing:5", used to spot superseded jobs
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending/running/done/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class OutboxEmail(db.Model):
+    """Email waiting to be sent by MailDispatcher; routes only ever insert these."""
+    __tablename__ = "outbox_email"
+    __table_args__ = (
+        db.Index("ix_outbox_email_status_run_after", "status", "run_after"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(150), nullable=False)
+    recipient = db.Column(db.String(150), nullable=False)
+    subject = db.Column(db.String(300), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending/sending/sent/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    claim = db.Column(db.String(32), index=True)  # batch token of the dispatcher sending it
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+class ContentVersion(db.Model):
+    """Change counter for cached pages, bumped by the routes that change what a page shows."""
+    __tablename__ = "content_version"
+
+    key = db.Column(db.String(100), primary_key=True)  # "feed", "profiles" or "listing:<id>"
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class DailyRentalStats(db.Model):
+    """Rent requests per day of creation; maintained by record_rental_stats."""
+    __tablename__ = "daily_rental_stats"
+
+    day = db.Column(db.Date, primary_key=True)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    approved = db.Column(db.Integer, nullable=False, default=0)
+    declined = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)  # listing.price * days of approved requests
+
+class OwnerRentalStats(db.Model):
+    """Rent requests per listing owner; maintained by record_rental_stats."""
+    __tablename__ = "owner_rental_stats"
+
+    owner_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    approved = db.Column(db.Integer, nullable=False, default=0)
+    declined = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class OwnerNotification(db.Model):
+    """Rent request activity waiting to go out in the owner's next digest."""
+    __tablename__ = "owner_notification"
+    __table_args__ = (
+        db.Index("ix_owner_notification_pending", "sent_at", "owner_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    listing_id = db.Column(db.Integer, db.ForeignKey("listing.id", ondelete="CASCADE"))
+    rent_request_id = db.Column(db.Integer, db.ForeignKey("rent_request.id", ondelete="CASCADE"))
+    event = db.Column(db.String(20), nullable=False)  # "created" or "edited"
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+# ------------------------
+# BACKGROUND JOBS
+# ------------------------
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_SECONDS = int(os.getenv("JOB_RETRY_SECONDS", 10))  # doubled after each failed attempt
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 600))
+# "thread": each web process runs a worker pool; "external": only `flask run-worker` runs jobs
+JOB_WORKER_MODE = os.getenv("JOB_WORKER_MODE", "thread")
+
+JOB_HANDLERS = {}
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying cannot help."""
+
+def job_handler(kind):
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+def enqueue_job(kind, target=None, **payload):
+    """Add a job to the current transaction; workers see it once the caller commits."""
+    job = Job(kind=kind, target=target, payload=json.dumps(payload))
+    db.session.add(job)
+    db.session.info["jobs_enqueued"] = True
+    return job
+
+@event.listens_for(Session, "after_commit")
+def _wake_background_workers(session):
+    if session.info.pop("jobs_enqueued", False):
+        job_worker.wake()
+    if session.info.pop("mail_enqueued", False):
+        mail_dispatcher.wake()
+
+def recover_stale_jobs():
+    """Requeue jobs left running by a worker that died mid-job."""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    Job.query.filter(Job.status == "running", Job.updated_at < cutoff).update(
+        {Job.status: "pending"}, synchronize_session=False
+    )
+    db.session.commit()
+
+def next_job_ids(limit):
+    return [job_id for (job_id,) in (
+        db.session.query(Job.id)
+        .filter(Job.status == "pending", Job.run_after <= datetime.utcnow())
+        .order_by(Job.run_after, Job.id)
+        .limit(limit)
+    )]
+
+def claim_job(job_id):
+    """Atomically mark a pending job as running; False if another worker got it first."""
+    claimed = Job.query.filter_by(id=job_id, status="pending").update(
+        {Job.status: "running", Job.attempts: Job.attempts + 1, Job.updated_at: datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return claimed == 1
+
+def run_job(job_id):
+    """Run a claimed job and record the outcome, scheduling a retry on failure."""
+    job = db.session.get(Job, job_id)
+    try:
+        handler = JOB_HANDLERS.get(job.kind)
+        if handler is None:
+            raise PermanentJobError(f"no handler for job kind {job.kind!r}")
+        handler(job, json.loads(job.payload))
+        job.status = "done"
+        job.error = None
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.error = f"{type(e).__name__}: {e}"
+        if isinstance(e, PermanentJobError) or job.attempts >= JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+        else:
+            job.status = "pending"
+            job.run_after = datetime.utcnow() + timedelta(seconds=JOB_RETRY_SECONDS * 2 ** (job.attempts - 1))
+        app.logger.warning("Job %s (%s) failed, now %s: %s", job.id, job.kind, job.status, job.error, exc_info=True)
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+def run_pending_jobs():
+    """Run every due job synchronously in this thread; returns how many ran."""
+    recover_stale_jobs()
+    ran = 0
+    while True:
+        job_ids = next_job_ids(1)
+        if not job_ids:
+            return ran
+        if claim_job(job_ids[0]):
+            run_job(job_ids[0])
+            ran += 1
+
+class JobWorker:
+    """Bounded thread pool that claims due jobs and runs them outside of requests."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._wake = threading.Event()
+        self._slots = threading.BoundedSemaphore(workers)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Started lazily per process: threads do not survive gunicorn's fork
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _dispatch_loop(self):
+        while True:
+            self._wake.wait(JOB_POLL_SECONDS)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    recover_stale_jobs()
+                    for job_id in next_job_ids(self.workers):
+                        if not self._slots.acquire(blocking=False):
+                            break
+                        if claim_job(job_id):
+                            self._executor.submit(self._run, job_id)
+                        else:
+                            self._slots.release()
+            except Exception:
+                app.logger.exception("Job dispatcher error")
+
+    def _run(self, job_id):
+        try:
+            with app.app_context():
+                run_job(job_id)
+        finally:
+            self._slots.release()
+            self.wake()
+
+job_worker = JobWorker(JOB_WORKERS)
+
+# ------------------------
+# EMAIL OUTBOX
+# ------------------------
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "1") == "1"  # set to 0 for a local SMTP stand-in
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", 10))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", 5))
+MAIL_IDLE_SECONDS = int(os.getenv("MAIL_IDLE_SECONDS", 60))  # keep the SMTP session open between batches
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 6))
+MAIL_RETRY_SECONDS = int(os.getenv("MAIL_RETRY_SECONDS", 30))  # doubled after each failed attempt
+
+def queue_email(recipient, subject, body, sender=None):
+    """Add an email to the outbox in the current transaction; the dispatcher sends it after commit."""
+    message = OutboxEmail(sender=sender or ADMIN_EMAIL, recipient=recipient, subject=subject, body=body)
+    db.session.add(message)
+    db.session.info["mail_enqueued"] = True
+    return message
+
+def open_smtp():
+    import smtplib
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    if SMTP_USE_TLS:
+        server.starttls()
+    if ADMIN_PASSWORD:
+        server.login(ADMIN_EMAIL, ADMIN_PASSWORD)
+    return server
+
+def claim_outbox_batch(limit):
+    """Atomically claim up to `limit` due messages for this dispatcher."""
+    now = datetime.utcnow()
+    OutboxEmail.query.filter(
+        OutboxEmail.status == "sending",
+        OutboxEmail.updated_at < now - timedelta(seconds=JOB_STALE_SECONDS)
+    ).update({OutboxEmail.status: "pending"}, synchronize_session=False)
+
+    token = uuid.uuid4().hex
+    due = (
+        db.session.query(OutboxEmail.id)
+        .filter(OutboxEmail.status == "pending", OutboxEmail.run_after <= now)
+        .order_by(OutboxEmail.run_after, OutboxEmail.id)
+        .limit(limit)
+    )
+    OutboxEmail.query.filter(OutboxEmail.id.in_(due.scalar_subquery()), OutboxEmail.status == "pending").update(
+        {OutboxEmail.status: "sending", OutboxEmail.claim: token,
+         OutboxEmail.attempts: OutboxEmail.attempts + 1, OutboxEmail.updated_at: now},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return OutboxEmail.query.filter_by(claim=token, status="sending").order_by(OutboxEmail.id).all()
+
+class MailDispatcher:
+    """Sends outbox messages in batches over one long-lived, authenticated SMTP session."""
+
+    def __init__(self, smtp_factory=open_smtp):
+        self.smtp_factory = smtp_factory
+        self._server = None
+        self._last_used = 0
+        self._wake = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._server = None  # never reuse a socket inherited across fork
+            threading.Thread(target=self._dispatch_loop, name="mail-dispatcher", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _dispatch_loop(self):
+        while True:
+            self._wake.wait(MAIL_POLL_SECONDS)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    self.send_pending()
+            except Exception:
+                app.logger.exception("Mail dispatcher error")
+            if self._server and time.monotonic() - self._last_used > MAIL_IDLE_SECONDS:
+                self._disconnect()
+
+    def send_pending(self):
+        """Send every due message, batch by batch; returns how many were sent."""
+        sent = 0
+        while True:
+            batch = claim_outbox_batch(MAIL_BATCH_SIZE)
+            if not batch:
+                return sent
+            sent += self.send_batch(batch)
+
+    def send_batch(self, batch):
+        import smtplib
+        sent = 0
+        for i, message in enumerate(batch):
+            try:
+                self._send(message)
+            except smtplib.SMTPRecipientsRefused as e:
+                # Not an SMTPResponseException; the codes are per recipient
+                permanent = all(code >= 500 for code, _ in e.recipients.values())
+                self._record_failure(message, e, permanent=permanent)
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code >= 500:
+                    # Rejected by the server (bad address, policy); retrying will not help
+                    self._record_failure(message, e, permanent=True)
+                else:
+                    self._record_failure(message, e)
+            except (smtplib.SMTPException, OSError) as e:
+                # Connection-level problem: back off the rest of the batch too
+                self._disconnect()
+                for pending in batch[i:]:
+                    self._record_failure(pending, e)
+                db.session.commit()
+                return sent
+            else:
+                message.status = "sent"
+                message.error = None
+                message.sent_at = datetime.utcnow()
+                sent += 1
+            message.updated_at = datetime.utcnow()
+            db.session.commit()  # per message, so a crash never re-sends what already went out
+        return sent
+
+    def _send(self, message):
+        import smtplib
+        from email.mime.text import MIMEText
+        mime = MIMEText(message.body)
+        mime["Subject"] = message.subject
+        mime["From"] = message.sender
+        mime["To"] = message.recipient
+        for attempt in range(2):
+            try:
+                self._connection().sendmail(message.sender, [message.recipient], mime.as_string())
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # The idle session timed out on the server side; reconnect once
+                self._disconnect()
+                if attempt:
+                    raise
+
+    def _connection(self):
+        if self._server is None:
+            self._server = self.smtp_factory()
+        return self._server
+
+    def _disconnect(self):
+        import smtplib
+        server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+
+    def _record_failure(self, message, error, permanent=False):
+        message.error = f"{type(error).__name__}: {error}"
+        message.updated_at = datetime.utcnow()
+        if permanent or message.attempts >= MAIL_MAX_ATTEMPTS:
+            message.status = "failed"
+        else:
+            message.status = "pending"
+            message.run_after = datetime.utcnow() + timedelta(
+                seconds=MAIL_RETRY_SECONDS * 2 ** (message.attempts - 1)
+            )
+        app.logger.warning(
+            "Email %s to %s failed, now %s: %s", message.id, message.recipient, message.status, message.error,
+            exc_info=error
+        )
+
+mail_dispatcher = MailDispatcher()
+
+# ------------------------
+# OWNER DIGESTS
+# ------------------------
+DIGEST_INTERVAL_SECONDS = int(os.getenv("DIGEST_INTERVAL_SECONDS", 900))
+DIGEST_EVENTS = {
+    "created": "{renter} requested \"{title}\" for {days} days from {start:%d %b %Y}",
+    "edited": "{renter} updated their request for \"{title}\" ({days} days from {start:%d %b %Y})",
+}
+
+def notify_owner(listing, rent_request, event):
+    """Record rent request activity for the owner's next digest instead of emailing now."""
+    db.session.add(OwnerNotification(
+        owner_id=listing.user_id,
+        listing_id=listing.id,
+        rent_request_id=rent_request.id,
+        event=event
+    ))
+    # One pending digest job covers every event until it runs
+    scheduled = db.session.query(exists().where(
+        Job.target == "owner-digest", Job.status == "pending"
+    )).scalar()
+    if not scheduled:
+        job = enqueue_job("owner_digest", target="owner-digest")
+        job.run_after = datetime.utcnow() + timedelta(seconds=DIGEST_INTERVAL_SECONDS)
+
+def send_owner_digests():
+    """Queue one outbox email per owner covering all of their unsent events."""
+    owner = aliased(User)
+    renter = aliased(User)
+    rows = (
+        db.session.query(
+            OwnerNotification.id, OwnerNotification.event, owner.id, owner.email, owner.username,
+            Listing.title, renter.username, RentRequest.days, RentRequest.start_date
+        )
+        .join(owner, OwnerNotification.owner_id == owner.id)
+        .outerjoin(Listing, OwnerNotification.listing_id == Listing.id)
+        .outerjoin(RentRequest, OwnerNotification.rent_request_id == RentRequest.id)
+        .outerjoin(renter, RentRequest.renter_id == renter.id)
+        .filter(OwnerNotification.sent_at.is_(None))
+        .order_by(owner.id, OwnerNotification.id)
+        .all()
+    )
+    digests = 0
+    for (owner_id, email, username), events in itertools.groupby(rows, key=lambda row: row[2:5]):
+        events = list(events)
+        lines = [
+            "- " + DIGEST_EVENTS[event].format(renter=renter_name or "A user", title=title, days=days, start=start)
+            for _, event, _, _, _, title, renter_name, days, start in events
+            if title is not None and start is not None  # listing or request deleted since
+        ]
+        if email and lines:
+            queue_email(
+                email,
+                f"Rented: {len(lines)} new rental request update{'s' if len(lines) != 1 else ''}",
+                f"Hello {username},\n\nHere is what happened on your listings:\n\n"
+                + "\n".join(lines)
+                + "\n\nBest regards,\nRented Team"
+            )
+            digests += 1
+    if rows:
+        OwnerNotification.query.filter(OwnerNotification.id.in_([row[0] for row in rows])).update(
+            {OwnerNotification.sent_at: datetime.utcnow()}, synchronize_session=False
+        )
+    db.session.commit()
+    return digests
+
+@job_handler("owner_digest")
+def owner_digest_job(job, payload):
+    send_owner_digests()
+
+@app.cli.command("send-digests")
+def send_digests_command():
+    """Queue owner digests now instead of waiting for the next interval."""
+    print(f"Queued {send_owner_digests()} digests.")
+
+@app.before_request
+def start_background_workers():
+    if JOB_WORKER_MODE == "thread" and not app.testing:
+        job_worker.start()
+        mail_dispatcher.start()
+
+@app.cli.command("run-worker")
+@click.option("--once", is_flag=True, help="Run the jobs and emails that are due now and exit.")
+def run_worker_command(once):
+    """Run background jobs and the email dispatcher in a dedicated process."""
+    if once:
+        print(f"Ran {run_pending_jobs()} jobs, sent {mail_dispatcher.send_pending()} emails.")
+        mail_dispatcher._disconnect()
+        return
+    job_worker.start()
+    mail_dispatcher.start()
+    threading.Event().wait()
+
+# ------------------------
+# UPLOAD PROCESSING
+# ------------------------
+STAGING_FOLDER = os.path.join(instance_folder, "staging")
+os.makedirs(STAGING_FOLDER, exist_ok=True)
+
+# Processed uploads of every kind share one content-addressed store under
+# static/, so an image uploaded twice (or as both a listing photo and an
+# avatar) is stored once. Rows reference files by their stored value; a file
+# is live while any Listing.image or User.profile_pic points at it.
+IMAGE_STORE = "uploads"
+os.makedirs(os.path.join(app.static_folder, IMAGE_STORE), exist_ok=True)
+
+# Which column a processed upload is written to
+IMAGE_TARGETS = {
+    "listing": (Listing, "image"),
+    "user": (User, "profile_pic"),
+}
+
+def static_image_path(kind, stored):
+    """Path under static/ for a stored Listing.image or User.profile_pic value."""
+    if kind == "listing" and not stored.startswith(IMAGE_STORE + "/"):
+        return "listing_images/" + stored  # listing images used to be relative to their own folder
+    return stored
+
+app.jinja_env.globals["listing_image_path"] = lambda image: static_image_path("listing", image or "default_listing.png")
+
+def stage_upload(upload):
+    """Check the upload looks like an image and park it for the job worker."""
+    with PILImage.open(upload.stream):  # only parses the header
+        pass
+    upload.stream.seek(0)
+    path = os.path.join(STAGING_FOLDER, uuid.uuid4().hex)
+    upload.save(path)
+    return path
+
+def enqueue_image_processing(kind, row_id, staged_path):
+    return enqueue_job("process_image", target=f"{kind}:{row_id}", staged=staged_path)
+
+@job_handler("process_image")
+def process_image_job(job, payload):
+    kind, row_id = job.target.split(":")
+    model, column = IMAGE_TARGETS[kind]
+    column = getattr(model, column)
+    staged = payload["staged"]
+    if not os.path.exists(staged):
+        raise PermanentJobError("staged upload is missing")
+    try:
+        with open(staged, "rb") as f:
+            stored = f"{IMAGE_STORE}/{save_image_derivatives(f, os.path.join(app.static_folder, IMAGE_STORE))}"
+    except INVALID_IMAGE_ERRORS as e:
+        os.remove(staged)
+        raise PermanentJobError(str(e))
+
+    # A later upload for the same row wins, whatever order the jobs finish in
+    superseded = db.session.query(exists().where(
+        Job.target == job.target, Job.kind == job.kind, Job.id > job.id, Job.status != "failed"
+    )).scalar()
+    row = db.session.query(column).filter(model.id == int(row_id)).first()
+    previous = row[0] if row else None
+    if superseded or row is None:
+        schedule_file_cleanup(images=[(kind, stored)])  # kept only if another row uses the same image
+    elif previous != stored:
+        model.query.filter_by(id=int(row_id)).update({column: stored}, synchronize_session=False)
+        bump_versions("feed", "profiles" if model is User else f"listing:{row_id}")
+        schedule_file_cleanup(images=[(kind, previous)])
+    db.session.commit()
+    if model is User:
+        _user_cache.delete(int(row_id))
+    os.remove(staged)
+
+# ------------------------
+# FILE CLEANUP
+# ------------------------
+# Rows are deleted by the database (ON DELETE CASCADE); their files are removed
+# afterwards by a background job so a large delete never waits on the disk.
+DEFAULT_IMAGES = {"default_listing.png", "profile_pics/default.png"}
+
+def _image_files(kind, stored):
+    """Paths on disk for a stored Listing.image / User.profile_pic value, derivatives included."""
+    path = os.path.join(app.static_folder, static_image_path(kind, stored))
+    match = DERIVATIVE_RE.match(os.path.basename(path))
+    if not match:
+        return [path]
+    digest_prefix = f"{match.group('digest')}_"
+    return [entry.path for entry in os.scandir(os.path.dirname(path)) if entry.name.startswith(digest_prefix)]
+
+def _image_in_use(kind, stored):
+    """True while some row still references this file (or its derivative set)."""
+    match = DERIVATIVE_RE.match(stored)
+    if match and stored.startswith(IMAGE_STORE + "/"):
+        # Store files are shared by every kind and by identical uploads
+        targets = IMAGE_TARGETS.values()
+    else:
+        targets = [IMAGE_TARGETS[kind]]
+    conditions = []
+    for model, column in targets:
+        column = getattr(model, column)
+        if match:
+            conditions.append(column.like(f"{match.group('prefix')}{match.group('digest')}\\_%", escape="\\"))
+        else:
+            conditions.append(column == stored)
+    return any(db.session.query(exists().where(condition)).scalar() for condition in conditions)
+
+def schedule_file_cleanup(images=(), request_ids=()):
+    """Queue removal of image files and cached PDFs once the caller's transaction commits.
+
+    images is a list of (kind, stored value) pairs, kind being a key of IMAGE_TARGETS.
+    """
+    images = [(kind, stored) for kind, stored in images if stored and stored not in DEFAULT_IMAGES]
+    request_ids = list(request_ids)
+    if images or request_ids:
+        enqueue_job("delete_files", images=images, request_ids=request_ids)
+
+@job_handler("delete_files")
+def delete_files_job(job, payload):
+    invalidate_request_pdfs(payload["request_ids"])
+    for kind, stored in payload["images"]:
+        if _image_in_use(kind, stored):
+            continue  # another row still shows the same file
+        for path in _image_files(kind, stored):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def delete_listing_records(listing):
+    """Delete a listing; its requests go with it in the database."""
+    request_ids = [rid for (rid,) in db.session.query(RentRequest.id).filter_by(listing_id=listing.id)]
+    unindex_listings([listing.id])
+    record_rental_stats(removed=listing_stats_rows([listing.id]))
+    bump_versions("feed", f"listing:{listing.id}")
+    schedule_file_cleanup(images=[("listing", listing.image)], request_ids=request_ids)
+    db.session.delete(listing)
+
+def delete_user_records(user):
+    """Delete a user with a handful of statements, whatever they own.
+
+    Listings, their requests, notifications and owner stats cascade in the
+    database; requests the user made as a renter keep their row without a renter.
+    """
+    listings = db.session.query(Listing.id, Listing.image).filter_by(user_id=user.id).all()
+    listing_ids = [listing_id for listing_id, _ in listings]
+    # Cached PDFs of requests on their listings, and of their own rentals, which show their name
+    request_ids = [rid for (rid,) in (
+        db.session.query(RentRequest.id)
+        .join(Listing, RentRequest.listing_id == Listing.id)
+        .filter((Listing.user_id == user.id) | (RentRequest.renter_id == user.id))
+    )]
+    unindex_listings(listing_ids)
+    record_rental_stats(removed=listing_stats_rows(listing_ids))
+    bump_versions("feed", "profiles")
+    schedule_file_cleanup(
+        images=[("listing", image) for _, image in listings] + [("user", user.profile_pic)],
+        request_ids=request_ids,
+    )
+    db.session.delete(user)
+
+# ------------------------
+# RENTAL STATE
+# ------------------------
+# A listing can have any number of approved bookings as long as their date
+# ranges do not overlap. Listing.is_rented means "booked today"; it is
+# recomputed whenever a booking changes and again on the days bookings start
+# and end (see schedule_rental_state_sync).
+BOOKING_MAX_DAYS = int(os.getenv("BOOKING_MAX_DAYS", 90))
+BOOKING_HORIZON_DAYS = int(os.getenv("BOOKING_HORIZON_DAYS", 365))  # how far ahead a booking may start
+CALENDAR_MONTHS = int(os.getenv("CALENDAR_MONTHS", 2))
+
+class BookingConflict(Exception):
+    """Raised when a booking would overlap an approved one."""
+
+def overlaps(start_date, end_date):
+    """Filter for requests whose [start_date, end_date) range overlaps the given one."""
+    return (RentRequest.start_date < end_date) & (RentRequest.end_date > start_date)
+
+def booking_conflict(listing_id, start_date, end_date, exclude_id=None):
+    """Whether an approved booking of the listing overlaps the dates; one index range scan."""
+    query = RentRequest.query.filter(
+        RentRequest.listing_id == listing_id,
+        RentRequest.status == "Approved",
+        overlaps(start_date, end_date),
+    )
+    if exclude_id is not None:
+        query = query.filter(RentRequest.id != exclude_id)
+    return db.session.query(query.exists()).scalar()
+
+def parse_booking_dates(form):
+    """(start_date, end_date) from a request form; raises ValueError with a message for the user."""
+    try:
+        start_date = date.fromisoformat(form.get("start_date", ""))
+        end_date = date.fromisoformat(form.get("end_date", ""))
+    except ValueError:
+        raise ValueError("Please pick a start and a return date.")
+    today = datetime.utcnow().date()
+    if start_date < today:
+        raise ValueError("Bookings cannot start in the past.")
+    if end_date <= start_date:
+        raise ValueError("The return date must be after the start date.")
+    if (end_date - start_date).days > BOOKING_MAX_DAYS:
+        raise ValueError(f"Bookings can be at most {BOOKING_MAX_DAYS} days long.")
+    if start_date > today + timedelta(days=BOOKING_HORIZON_DAYS):
+        raise ValueError(f"Bookings can start at most {BOOKING_HORIZON_DAYS} days ahead.")
+    return start_date, end_date
+
+def rented_today():
+    today = datetime.utcnow().date()
+    return exists().where(
+        RentRequest.listing_id == Listing.id,
+        RentRequest.status == "Approved",
+        RentRequest.start_date <= today,
+        RentRequest.end_date > today,
+    )
+
+def sync_rental_state(listing_id):
+    """Recompute Listing.is_rented from its bookings inside the current transaction."""
+    db.session.flush()
+    db.session.query(Listing).filter(Listing.id == listing_id).update(
+        {Listing.is_rented: rented_today()}, synchronize_session="fetch"
+    )
+
+def schedule_rental_state_sync(listing_id, start_date, end_date):
+    """Queue is_rented refreshes for the days a booking starts and ends."""
+    today = datetime.utcnow().date()
+    for day in (start_date, end_date):
+        if day > today:
+            job = enqueue_job("sync_rental_state", target=f"listing:{listing_id}", listing_id=listing_id)
+            job.run_after = datetime(day.year, day.month, day.day)
+
+@job_handler("sync_rental_state")
+def sync_rental_state_job(job, payload):
+    sync_rental_state(payload["listing_id"])
+    bump_versions("feed", f"listing:{payload['listing_id']}")
+
+def availability_calendar(listing_id, today, months=CALENDAR_MONTHS):
+    """Month grids from the current month on, with the days of approved bookings marked."""
+    first = today.replace(day=1)
+    month_starts = [first]
+    for _ in range(months):
+        month_starts.append((month_starts[-1] + timedelta(days=32)).replace(day=1))
+    last = month_starts.pop()  # first day after the calendar
+
+    booked = set()
+    bookings = db.session.query(RentRequest.start_date, RentRequest.end_date).filter(
+        RentRequest.listing_id == listing_id,
+        RentRequest.status == "Approved",
+        overlaps(first, last),
+    )
+    for start_date, end_date in bookings:
+        day = max(start_date, first)
+        while day < min(end_date, last):
+            booked.add(day)
+            day += timedelta(days=1)
+
+    grid = calendar.Calendar()
+    return [
+        {
+            "title": month.strftime("%B %Y"),
+            "weeks": [
+                [
+                    {"day": day, "in_month": day.month == month.month, "booked": day in booked, "past": day < today}
+                    for day in week
+                ]
+                for week in grid.monthdatescalendar(month.year, month.month)
+            ],
+        }
+        for month in month_starts
+    ]
+
+def lock_listing(listing_id):
+    """Serialize writers on one listing until the current transaction ends.
+
+    Postgres locks the listing row (SELECT ... FOR UPDATE). SQLite has no row
+    locks, so the transaction is started with BEGIN IMMEDIATE, which takes the
+    database write lock up front; other writers wait on busy_timeout. Returns
+    the freshly loaded listing, or None if it no longer exists.
+    """
+    if db.engine.dialect.name == "sqlite":
+        connection = db.session.connection()
+        if not connection.connection.driver_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        return db.session.get(Listing, listing_id, populate_existing=True)
+    return (
+        Listing.query.filter_by(id=listing_id)
+        .with_for_update()
+        .populate_existing()
+        .one_or_none()
+    )
+
+def approve_rent_request(rent_request_id):
+    """Approve one request and decline the pending requests its dates overlap.
+
+    Runs as set-based UPDATEs while the listing is locked, so concurrent
+    approvals of the same listing apply one after the other. Returns the
+    listing, or None if the request disappeared before the lock was taken;
+    raises BookingConflict if an approved booking already covers its dates.
+    """
+    listing_id = db.session.query(RentRequest.listing_id).filter_by(id=rent_request_id).scalar()
+    listing = lock_listing(listing_id) if listing_id else None
+    if listing is None:
+        return None
+    rent_request = db.session.get(RentRequest, rent_request_id, populate_existing=True)
+    if rent_request is None or rent_request.listing_id != listing.id:
+        return None  # deleted, or moved to another listing, while we waited
+    start_date, end_date = rent_request.start_date, rent_request.end_date
+    if booking_conflict(listing.id, start_date, end_date, exclude_id=rent_request.id):
+        raise BookingConflict(rent_request_id)
+
+    # Only requests whose status changes matter for the stats deltas
+    competing = (
+        RentRequest.listing_id == listing.id,
+        RentRequest.id != rent_request_id,
+        RentRequest.status == "Pending",
+        overlaps(start_date, end_date),
+    )
+    changing = [rent_request, *RentRequest.query.filter(*competing).populate_existing()]
+    before = [rental_stats_row(r, listing) for r in changing]
+
+    RentRequest.query.filter(*competing).update({RentRequest.status: "Declined"}, synchronize_session=False)
+    RentRequest.query.filter_by(id=rent_request_id).update(
+        {RentRequest.status: "Approved"}, synchronize_session=False
+    )
+
+    after = [
+        row[:2] + ("Approved" if r.id == rent_request_id else "Declined",) + row[3:]
+        for r, row in zip(changing, before)
+    ]
+    record_rental_stats(added=after, removed=before)
+    for r in changing:
+        db.session.expire(r, ["status"])  # the UPDATEs above bypassed the session
+    sync_rental_state(listing.id)
+    schedule_rental_state_sync(listing.id, start_date, end_date)
+    return listing
+
+# ------------------------
+# LISTING SEARCH
+# ------------------------
+# SQLite: a standalone FTS5 table whose rowid is the listing id, kept in sync
+# by index_listing()/unindex_listings(). Postgres: a generated tsvector column
+# with a GIN index, which the database keeps in sync on its own.
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 24))
+LISTING_FTS = sa_table("listing_fts", sa_column("rowid"))
+PG_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+def _uses_fts5():
+    return db.engine.dialect.name == "sqlite"
+
+def setup_search_index():
+    """Create the full-text index for listings if it is missing, and fill it."""
+    if _uses_fts5():
+        with db.engine.begin() as conn:
+            found = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listing_fts'"
+            )).first()
+            if not found:
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE listing_fts USING fts5(title, description, tokenize = 'porter unicode61')"
+                ))
+                conn.execute(text(
+                    "INSERT INTO listing_fts (rowid, title, description) SELECT id, title, description FROM listing"
+                ))
+    elif db.engine.dialect.name == "postgresql":
+        if "search_vector" not in {c["name"] for c in inspect(db.engine).get_columns("listing")}:
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE listing ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                    f"GENERATED ALWAYS AS ({PG_SEARCH_VECTOR}) STORED"
+                ))
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_listing_search_vector ON listing USING GIN (search_vector)"
+            ))
+
+def index_listing(listing):
+    """Add or refresh a listing in the search index, in the caller's transaction."""
+    if not _uses_fts5():
+        return
+    db.session.flush()
+    db.session.execute(text("DELETE FROM listing_fts WHERE rowid = :id"), {"id": listing.id})
+    db.session.execute(
+        text("INSERT INTO listing_fts (rowid, title, description) VALUES (:id, :title, :description)"),
+        {"id": listing.id, "title": listing.title, "description": listing.description}
+    )
+
+def unindex_listings(listing_ids):
+    if not _uses_fts5() or not listing_ids:
+        return
+    for listing_id in listing_ids:
+        db.session.execute(text("DELETE FROM listing_fts WHERE rowid = :id"), {"id": listing_id})
+
+def fts5_query(terms):
+    # Quote every word so user input can never be parsed as FTS5 syntax; prefix-match each one
+    words = re.findall(r"\w+", terms)
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_listings(terms, min_price=None, max_price=None, availability=None, page=1):
+    """Ranked, filtered listing search.
+
+    Returns (listings, has_next, facets) where facets counts the available
+    and rented matches before the availability filter is applied.
+    """
+    query = Listing.query
+    rank = None
+    if terms and _uses_fts5():
+        match = fts5_query(terms)
+        if not match:
+            return [], False, {"available": 0, "rented": 0}
+        query = query.join(LISTING_FTS, LISTING_FTS.c.rowid == Listing.id).filter(
+            text("listing_fts MATCH :match")
+        ).params(match=match)
+        rank = text("bm25(listing_fts, 10.0, 1.0)")
+    elif terms:
+        tsquery = "websearch_to_tsquery('english', :terms)"
+        query = query.filter(text(f"listing.search_vector @@ {tsquery}")).params(terms=terms)
+        rank = text(f"ts_rank_cd(listing.search_vector, {tsquery}) DESC")
+
+    if min_price is not None:
+        query = query.filter(Listing.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Listing.price <= max_price)
+
+    facet_rows = query.with_entities(Listing.is_rented, db.func.count()).group_by(Listing.is_rented).all()
+    facets = {"available": 0, "rented": 0}
+    for rented, count in facet_rows:
+        facets["rented" if rented else "available"] += count
+
+    if availability == "available":
+        query = query.filter(Listing.is_rented.is_(False))
+    elif availability == "rented":
+        query = query.filter(Listing.is_rented.is_(True))
+
+    order = [Listing.created_at.desc(), Listing.id.desc()]
+    if rank is not None:
+        order.insert(0, rank)
+    rows = (
+        query.options(joinedload(Listing.user))
+        .order_by(*order)
+        .offset((page - 1) * SEARCH_PAGE_SIZE)
+        .limit(SEARCH_PAGE_SIZE + 1)
+        .all()
+    )
+    return rows[:SEARCH_PAGE_SIZE], len(rows) > SEARCH_PAGE_SIZE, facets
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Rebuild the SQLite full-text index from the listing table."""
+    if not _uses_fts5():
+        print("Postgres keeps listing.search_vector up to date; nothing to rebuild.")
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM listing_fts"))
+        conn.execute(text(
+            "INSERT INTO listing_fts (rowid, title, description) SELECT id, title, description FROM listing"
+        ))
+    print("Search index rebuilt.")
+
+# ------------------------
+# ADMIN USER LIST
+# ------------------------
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 50))
+ADMIN_SORTS = ("id", "username", "email", "created_at", "listings", "requests", "last_activity")
+
+def admin_user_rows(search="", sort="id", descending=False, page=1):
+    """One page of users with listing count, request count and last activity.
+
+    Returns (rows, has_next). Everything comes from a single statement: listings
+    and requests are unioned into one activity stream and grouped per user.
+    When sorting by a user column only the users on the page are aggregated.
+    """
+    users = select(User.id)
+    if search:
+        pattern = f"%{search}%"
+        users = users.where(User.username.ilike(pattern) | User.email.ilike(pattern))
+
+    user_sorts = {"id": User.id, "username": User.username, "email": User.email, "created_at": User.created_at}
+    offset = (page - 1) * ADMIN_PAGE_SIZE
+    listings = select(
+        Listing.user_id.label("user_id"), literal("listing").label("kind"), Listing.created_at.label("at")
+    )
+    requests = select(
+        RentRequest.renter_id.label("user_id"), literal("request").label("kind"), RentRequest.created_at.label("at")
+    )
+
+    page_users = None
+    if sort in user_sorts:
+        key = user_sorts[sort]
+        page_users = (
+            users.order_by(key.desc() if descending else key.asc(), User.id)
+            .offset(offset).limit(ADMIN_PAGE_SIZE + 1)
+            .subquery("page_users")
+        )
+        page_ids = select(page_users.c.id)
+        listings = listings.where(Listing.user_id.in_(page_ids))
+        requests = requests.where(RentRequest.renter_id.in_(page_ids))
+
+    activity = union_all(listings, requests).subquery("activity")
+    stats = (
+        select(
+            activity.c.user_id,
+            db.func.sum(case((activity.c.kind == "listing", 1), else_=0)).label("listing_count"),
+            db.func.sum(case((activity.c.kind == "request", 1), else_=0)).label("request_count"),
+            db.func.max(activity.c.at).label("last_at"),
+        )
+        .group_by(activity.c.user_id)
+        .subquery("stats")
+    )
+    listing_count = db.func.coalesce(stats.c.listing_count, 0).label("listing_count")
+    request_count = db.func.coalesce(stats.c.request_count, 0).label("request_count")
+    last_activity = db.func.coalesce(stats.c.last_at, User.created_at).label("last_activity")
+
+    # Password hashes are deliberately not selected
+    statement = select(
+        User.id, User.username, User.email, User.is_admin, User.created_at,
+        listing_count, request_count, last_activity,
+    ).outerjoin(stats, stats.c.user_id == User.id)
+
+    if page_users is not None:
+        key = user_sorts[sort]
+        statement = statement.join(page_users, page_users.c.id == User.id)
+    else:
+        key = {"listings": listing_count, "requests": request_count}.get(sort, last_activity)
+        statement = (
+            statement.where(User.id.in_(users))
+            .offset(offset).limit(ADMIN_PAGE_SIZE + 1)
+        )
+    statement = statement.order_by(key.desc() if descending else key.asc(), User.id)
+
+    rows = db.session.execute(statement).all()
+    return rows[:ADMIN_PAGE_SIZE], len(rows) > ADMIN_PAGE_SIZE
+
+# ------------------------
+# RENTAL ANALYTICS
+# ------------------------
+# Summary tables updated in the same transaction as every rent request change,
+# so the analytics page reads a few precomputed rows instead of the history.
+# Requests count towards the day they were created on.
+ANALYTICS_DEFAULT_DAYS = int(os.getenv("ANALYTICS_DEFAULT_DAYS", 30))
+ANALYTICS_TOP_OWNERS = int(os.getenv("ANALYTICS_TOP_OWNERS", 20))
+
+def increment_counters(model, key, increments, **values):
+    """Add increments to the row identified by key, creating it if needed."""
+    dialect = db.engine.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite_dialect.insert if dialect == "sqlite" else postgresql_dialect.insert
+        stmt = insert(model).values(**key, **increments, **values)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={
+                **{name: getattr(model, name) + amount for name, amount in increments.items()},
+                **values,
+            },
+        ))
+        return
+    updated = model.query.filter_by(**key).update(
+        {**{getattr(model, name): getattr(model, name) + amount for name, amount in increments.items()}, **values},
+        synchronize_session=False,
+    )
+    if not updated:
+        db.session.add(model(**key, **increments, **values))
+
+def rental_stats_row(rent_request, listing):
+    """Snapshot of what one request contributes to the summary tables."""
+    created = rent_request.created_at or listing.created_at or datetime.utcnow()
+    return (created.date(), listing.user_id, rent_request.status, rent_request.days or 0, listing.price or 0)
+
+def record_rental_stats(added=(), removed=()):
+    """Apply the difference between two sets of rental_stats_row snapshots."""
+    daily, owners = {}, {}
+    for rows, sign in ((added, 1), (removed, -1)):
+        for day, owner_id, status, days, price in rows:
+            delta = {
+                "requests": sign,
+                "approved": sign if status == "Approved" else 0,
+                "declined": sign if status == "Declined" else 0,
+                "revenue": sign * price * days if status == "Approved" else 0,
+            }
+            for totals, key in ((daily, day), (owners, owner_id)):
+                current = totals.setdefault(key, dict.fromkeys(delta, 0))
+                for name, amount in delta.items():
+                    current[name] += amount
+
+    for model, column, totals in ((DailyRentalStats, "day", daily), (OwnerRentalStats, "owner_id", owners)):
+        for key, increments in totals.items():
+            if any(increments.values()):
+                increment_counters(model, {column: key}, increments)
+
+def listing_stats_rows(listing_ids):
+    """Snapshots for every request on these listings, in one query."""
+    if not listing_ids:
+        return []
+    rows = (
+        db.session.query(RentRequest, Listing)
+        .join(Listing, RentRequest.listing_id == Listing.id)
+        .filter(Listing.id.in_(listing_ids))
+        .all()
+    )
+    return [rental_stats_row(rent_request, listing) for rent_request, listing in rows]
+
+def rental_analytics(days):
+    """Totals, the last `days` days and the top owners, all from the summary tables."""
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    columns = lambda model: (
+        db.func.coalesce(db.func.sum(model.requests), 0).label("requests"),
+        db.func.coalesce(db.func.sum(model.approved), 0).label("approved"),
+        db.func.coalesce(db.func.sum(model.declined), 0).label("declined"),
+        db.func.coalesce(db.func.sum(model.revenue), 0).label("revenue"),
+    )
+    totals = db.session.query(*columns(DailyRentalStats)).one()
+    daily = (
+        DailyRentalStats.query
+        .filter(DailyRentalStats.day >= since)
+        .order_by(DailyRentalStats.day.desc())
+        .all()
+    )
+    owners = (
+        db.session.query(OwnerRentalStats, User.username)
+        .join(User, User.id == OwnerRentalStats.owner_id)
+        .filter(OwnerRentalStats.requests > 0)
+        .order_by(OwnerRentalStats.revenue.desc(), OwnerRentalStats.requests.desc())
+        .limit(ANALYTICS_TOP_OWNERS)
+        .all()
+    )
+    return totals, daily, owners
+
+@app.cli.command("rebuild-rental-stats")
+def rebuild_rental_stats_command():
+    """Recompute the rental summary tables from the full request history."""
+    created = db.func.coalesce(RentRequest.created_at, Listing.created_at)
+    aggregates = (
+        db.func.count(RentRequest.id),
+        db.func.sum(case((RentRequest.status == "Approved", 1), else_=0)),
+        db.func.sum(case((RentRequest.status == "Declined", 1), else_=0)),
+        db.func.sum(case((RentRequest.status == "Approved", Listing.price * RentRequest.days), else_=0)),
+    )
+    counters = ["requests", "approved", "declined", "revenue"]
+    by_day = (
+        select(db.func.date(created), *aggregates)
+        .join(Listing, RentRequest.listing_id == Listing.id)
+        .group_by(db.func.date(created))
+    )
+    by_owner = (
+        select(Listing.user_id, *aggregates)
+        .join(Listing, RentRequest.listing_id == Listing.id)
+        .group_by(Listing.user_id)
+    )
+    with db.engine.begin() as conn:
+        conn.execute(DailyRentalStats.__table__.delete())
+        conn.execute(OwnerRentalStats.__table__.delete())
+        conn.execute(DailyRentalStats.__table__.insert().from_select(["day", *counters], by_day))
+        conn.execute(OwnerRentalStats.__table__.insert().from_select(["owner_id", *counters], by_owner))
+    print(f"Rebuilt rental stats: {DailyRentalStats.query.count()} day(s), {OwnerRentalStats.query.count()} owner(s).")
+
+# ------------------------
+# SCHEMA UPGRADES
+# ------------------------
+# Columns added after the first release; db.create_all() never alters existing tables
+SCHEMA_COLUMNS = [
+    ("listing", "is_rented", "BOOLEAN NOT NULL DEFAULT false"),
+    ("rent_request", "start_date", "DATE"),
+    ("rent_request", "end_date", "DATE"),
+]
+# Indexes the models no longer declare
+SCHEMA_DROPPED_INDEXES = [
+    "ux_rent_request_one_approved",  # one approved request per listing, before date-range bookings
+    "ix_rent_request_listing_status",  # a prefix of ix_rent_request_listing_status_dates
+]
+
+# Approved bookings of a listing must not overlap, whatever the application does.
+# SQLite checks it in triggers (served by ix_rent_request_listing_status_dates);
+# Postgres uses an exclusion constraint, which needs btree_gist for the "=" on listing_id.
+SQLITE_BOOKING_OVERLAP_CHECK = """
+WHEN NEW.status = 'Approved' AND EXISTS (
+    SELECT 1 FROM rent_request
+    WHERE listing_id = NEW.listing_id AND status = 'Approved' AND id IS NOT NEW.id
+      AND start_date < NEW.end_date AND end_date > NEW.start_date
+)
+BEGIN SELECT RAISE(ABORT, 'overlapping approved booking'); END
+"""
+SQLITE_BOOKING_TRIGGERS = {
+    "rent_request_no_overlap_insert": "BEFORE INSERT ON rent_request",
+    "rent_request_no_overlap_update":
+        "BEFORE UPDATE OF status, start_date, end_date, listing_id ON rent_request",
+}
+PG_BOOKING_CONSTRAINT = "ex_rent_request_approved_overlap"
+
+def setup_booking_guard(conn):
+    """Create the overlap trigger or exclusion constraint if it is missing."""
+    if conn.dialect.name == "sqlite":
+        for name, timing in SQLITE_BOOKING_TRIGGERS.items():
+            conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {timing} {SQLITE_BOOKING_OVERLAP_CHECK}")
+        return
+    if conn.execute(text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": PG_BOOKING_CONSTRAINT}).first():
+        return
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+    except SQLAlchemyError as e:
+        # Managed databases may not allow it; approvals still check overlaps under the listing lock
+        app.logger.warning("Skipping the booking exclusion constraint (btree_gist unavailable): %s", e)
+        return
+    conn.execute(text(
+        f"ALTER TABLE rent_request ADD CONSTRAINT {PG_BOOKING_CONSTRAINT} EXCLUDE USING gist "
+        f"(listing_id WITH =, daterange(start_date, end_date) WITH &&) WHERE (status = 'Approved')"
+    ))
+
+def _add_column(table, column, ddl):
+    with db.engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+def _stale_foreign_keys(inspector):
+    """(table, constraint, existing name) for foreign keys whose ON DELETE rule differs from the models."""
+    stale = []
+    for table in db.metadata.sorted_tables:
+        if not any(constraint.ondelete for constraint in table.foreign_key_constraints):
+            continue
+        existing = {tuple(fk["constrained_columns"]): fk for fk in inspector.get_foreign_keys(table.name)}
+        for constraint in table.foreign_key_constraints:
+            current = existing.get(tuple(constraint.column_keys))
+            if not constraint.ondelete or current is None:
+                continue
+            if (current["options"].get("ondelete") or "").upper() != constraint.ondelete.upper():
+                stale.append((table, constraint, current.get("name")))
+    return stale
+
+def _rebuild_sqlite_tables(conn, tables):
+    """Recreate tables from the models, SQLite's only way to change a foreign key."""
+    # Rows left behind by deletes that predate the cascades would fail the final check
+    orphans = {
+        "listings deleted": conn.execute(text(
+            'DELETE FROM listing WHERE user_id NOT IN (SELECT id FROM "user")'
+        )).rowcount,
+        "rent requests deleted": conn.execute(text(
+            "DELETE FROM rent_request WHERE listing_id NOT IN (SELECT id FROM listing)"
+        )).rowcount,
+        "renters cleared": conn.execute(text(
+            'UPDATE rent_request SET renter_id = NULL WHERE renter_id NOT IN (SELECT id FROM "user")'
+        )).rowcount,
+    }
+    if any(orphans.values()):
+        app.logger.warning(
+            "Removed rows orphaned before ON DELETE rules existed: %s",
+            ", ".join(f"{count} {what}" for what, count in orphans.items())
+        )
+    preparer = conn.dialect.identifier_preparer
+    for table in tables:
+        name = preparer.format_table(table)
+        temp = preparer.quote(f"_rebuild_{table.name}")
+        create = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+        conn.exec_driver_sql(create.replace(f"CREATE TABLE {name} ", f"CREATE TABLE {temp} ", 1))
+        existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        columns = ", ".join(preparer.quote(c.name) for c in table.columns if c.name in existing)
+        conn.exec_driver_sql(f"INSERT INTO {temp} ({columns}) SELECT {columns} FROM {name}")
+        conn.exec_driver_sql(f"DROP TABLE {name}")
+        conn.exec_driver_sql(f"ALTER TABLE {temp} RENAME TO {name}")
+    # Indexes went with the old tables; upgrade_schema recreates them next
+    problems = conn.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+    if problems:
+        raise RuntimeError(f"foreign key violations after rebuilding tables: {problems[:5]}")
+
+def upgrade_foreign_keys():
+    """Give existing foreign keys the ON DELETE rules declared on the models."""
+    if not _stale_foreign_keys(inspect(db.engine)):
+        return
+    with db.engine.connect() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        try:
+            if sqlite:
+                conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+                conn.exec_driver_sql("BEGIN IMMEDIATE")  # one worker upgrades, the rest wait and re-check
+            else:
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('rented-upgrade-foreign-keys'))"))
+            stale = _stale_foreign_keys(inspect(conn))
+            if sqlite:
+                _rebuild_sqlite_tables(conn, list(dict.fromkeys(table for table, _, _ in stale)))
+            else:
+                preparer = conn.dialect.identifier_preparer
+                for table, constraint, name in stale:
+                    columns = ", ".join(preparer.quote(c) for c in constraint.column_keys)
+                    referred = ", ".join(preparer.quote(element.column.name) for element in constraint.elements)
+                    conn.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} DROP CONSTRAINT {preparer.quote(name)}"
+                    ))
+                    conn.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD CONSTRAINT {preparer.quote(name)} "
+                        f"FOREIGN KEY ({columns}) REFERENCES {preparer.format_table(constraint.referred_table)} "
+                        f"({referred}) ON DELETE {constraint.ondelete}"
+                    ))
+            conn.commit()
+        finally:
+            if sqlite:
+                # The connection goes back to the pool; never let it keep the cascades off.
+                # The pragma is ignored inside a transaction, so end a failed one first.
+                conn.rollback()
+                conn.exec_driver_sql("PRAGMA foreign_keys = ON")
+    if stale:
+        app.logger.info("Updated ON DELETE rules for %d foreign key(s).", len(stale))
+
+def upgrade_schema():
+    """Add missing columns and indexes to an existing database. Safe to run repeatedly."""
+    inspector = inspect(db.engine)
+    for table, column, ddl in SCHEMA_COLUMNS:
+        if column in {c["name"] for c in inspector.get_columns(table)}:
+            continue
+        try:
+            _add_column(table, column, ddl)
+        except SQLAlchemyError:
+            # Another worker may have added it first
+            inspector.clear_cache()
+            if column not in {c["name"] for c in inspect(db.engine).get_columns(table)}:
+                raise
+    upgrade_foreign_keys()
+
+    with db.engine.begin() as conn:
+        # The keyset feed cursor needs a timestamp on every listing
+        conn.execute(text("UPDATE listing SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"))
+        # Requests from before date ranges only had a length; date them from when they were made
+        if conn.dialect.name == "sqlite":
+            dated = conn.execute(text(
+                "UPDATE rent_request SET start_date = date(COALESCE(created_at, CURRENT_TIMESTAMP)), "
+                "end_date = date(COALESCE(created_at, CURRENT_TIMESTAMP), '+' || days || ' days') "
+                "WHERE start_date IS NULL"
+            )).rowcount
+        else:
+            dated = conn.execute(text(
+                "UPDATE rent_request SET start_date = CAST(COALESCE(created_at, CURRENT_TIMESTAMP) AS DATE), "
+                "end_date = CAST(COALESCE(created_at, CURRENT_TIMESTAMP) AS DATE) + days "
+                "WHERE start_date IS NULL"
+            )).rowcount
+        if dated:
+            # Old approvals now end on a date instead of renting the listing out forever
+            conn.execute(db.update(Listing).values(is_rented=rented_today()))
+            app.logger.info("Gave %d rent request(s) dates from their creation time.", dated)
+        for name in SCHEMA_DROPPED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+        setup_booking_guard(conn)
+    setup_search_index()
+
+def init_db():
+    """Create missing tables and bring existing ones up to date."""
+    db.create_all()
+    upgrade_schema()
+
+@app.cli.command("rebuild-rental-state")
+def rebuild_rental_state_command():
+    """Backfill/repair Listing.is_rented from existing rent requests."""
+    init_db()
+    updated = db.session.query(Listing).update({Listing.is_rented: rented_today()}, synchronize_session=False)
+    db.session.commit()
+    print(f"Rental state rebuilt for {updated} listings.")
+
+@app.cli.command("build-image-derivatives")
+def build_image_derivatives_command():
+    """Move images uploaded before the pipeline existed into the content-addressed store.
+
+    The originals are left in place; `flask gc-uploads` removes them once unreferenced.
+    """
+    store = os.path.join(app.static_folder, IMAGE_STORE)
+    converted = 0
+    stale = set()  # page cache keys whose pages still point at the old image URLs
+    for kind, (model, column) in IMAGE_TARGETS.items():
+        column = getattr(model, column)
+        for (name,) in db.session.query(column).filter(column.isnot(None)).distinct():
+            if name.startswith(IMAGE_STORE + "/") or name in DEFAULT_IMAGES:
+                continue
+            path = os.path.join(app.static_folder, static_image_path(kind, name))
+            if not os.path.exists(path):
+                print(f"Skipping missing file: {path}")
+                continue
+            try:
+                with open(path, "rb") as f:
+                    stored = f"{IMAGE_STORE}/{save_image_derivatives(f, store)}"
+            except INVALID_IMAGE_ERRORS as e:
+                print(f"Skipping unreadable image {path}: {e}")
+                continue
+            if model is User:
+                stale.add("profiles")
+            else:
+                stale.update(f"listing:{row_id}" for (row_id,) in db.session.query(model.id).filter(column == name))
+            model.query.filter(column == name).update({column: stored}, synchronize_session=False)
+            converted += 1
+    if converted:
+        bump_versions("feed", *sorted(stale))
+    db.session.commit()
+    print(f"Converted {converted} images.")
+
+GC_GRACE_SECONDS = int(os.getenv("GC_GRACE_SECONDS", 3600))
+
+@app.cli.command("gc-uploads")
+@click.option("--dry-run", is_flag=True, help="Only report what would be removed.")
+@click.option("--grace", default=GC_GRACE_SECONDS, help="Never remove files younger than this many seconds.")
+def gc_uploads_command(dry_run, grace):
+    """Remove uploaded images and staged files nothing references any more."""
+    live_files = {"listing_images/default_listing.png", "profile_pics/default.png"}
+    live_digests = set()  # (folder, digest): every derivative of a referenced upload
+    for kind, (model, column) in IMAGE_TARGETS.items():
+        column = getattr(model, column)
+        for (stored,) in db.session.query(column).filter(column.isnot(None)).distinct():
+            path = static_image_path(kind, stored)
+            match = DERIVATIVE_RE.match(path)
+            if match:
+                live_digests.add((os.path.dirname(path), match.group("digest")))
+            else:
+                live_files.add(path)
+
+    # Staged uploads still waiting for (or retrying) their processing job
+    live_staged = {
+        json.loads(payload).get("staged")
+        for (payload,) in db.session.query(Job.payload).filter(
+            Job.kind == "process_image", Job.status.in_(("pending", "running"))
+        )
+    }
+
+    cutoff = time.time() - grace
+    candidates = []
+    for folder in (IMAGE_STORE, "listing_images", "profile_pics"):
+        for entry in os.scandir(os.path.join(app.static_folder, folder)):
+            if not entry.is_file():
+                continue
+            match = DERIVATIVE_FILE_RE.match(entry.name)
+            if match and (folder, match.group("digest")) in live_digests:
+                continue
+            if not match and f"{folder}/{entry.name}" in live_files:
+                continue
+            candidates.append(entry)
+    candidates.extend(entry for entry in os.scandir(STAGING_FOLDER) if entry.path not in live_staged)
+
+    removed = reclaimed = 0
+    for entry in candidates:
+        try:
+            stat = entry.stat()
+            if stat.st_mtime > cutoff:
+                continue  # may belong to an upload whose row is not committed yet
+            if not dry_run:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        reclaimed += stat.st_size
+    action = "Would remove" if dry_run else "Removed"
+    print(f"{action} {removed} unreferenced file(s), reclaiming {reclaimed / 1024 / 1024:.1f} MB ({reclaimed} bytes).")
+
+# ------------------------
+# QUERY PLAN CHECK
+# ------------------------
+def hot_queries():
+    """Representative statements for the lookups that run on every page view."""
+    cursor = (datetime.utcnow(), 1)
+    return {
+        "home feed": Listing.query
+            .order_by(Listing.created_at.desc(), Listing.id.desc())
+            .limit(FEED_PAGE_SIZE + 1),
+        "home feed (next page)": Listing.query
+            .filter(tuple_(Listing.created_at, Listing.id) < tuple_(*cursor))
+            .order_by(Listing.created_at.desc(), Listing.id.desc())
+            .limit(FEED_PAGE_SIZE + 1),
+        "listings by owner": Listing.query.filter_by(user_id=1),
+        "request by listing and renter": RentRequest.query.filter_by(listing_id=1, renter_id=1),
+        "request by listing and status": RentRequest.query.filter_by(listing_id=1, status="Approved"),
+        "booking overlap": RentRequest.query.filter(
+            RentRequest.listing_id == 1, RentRequest.status == "Approved",
+            overlaps(cursor[0].date(), cursor[0].date() + timedelta(days=7)),
+        ),
+        "requests by renter": RentRequest.query.filter_by(renter_id=1),
+    }
+
+def explain(statement):
+    """Return the database's query plan for a statement as a list of lines."""
+    sqlite = db.engine.dialect.name == "sqlite"
+    prefix = "EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN "
+
+    def add_prefix(conn, cursor, sql, parameters, context, executemany):
+        return prefix + sql, parameters
+
+    with db.engine.connect() as conn:
+        if not sqlite:
+            # Small tables make Postgres prefer a seq scan even when an index exists
+            conn.execute(text("SET enable_seqscan = off"))
+        event.listen(conn, "before_cursor_execute", add_prefix, retval=True)
+        rows = conn.execute(statement).cursor.fetchall()
+    return [str(row[-1]) for row in rows]
+
+def is_full_scan(plan_line):
+    if db.engine.dialect.name == "sqlite":
+        return plan_line.startswith("SCAN ") and " USING " not in plan_line
+    return "Seq Scan" in plan_line
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if a hot query falls back to a full table scan."""
+    failed = False
+    for name, query in hot_queries().items():
+        plan = explain(query.statement)
+        scans = [line for line in plan if is_full_scan(line)]
+        print(f"{'FAIL' if scans else 'ok  '} {name}: {' | '.join(line.strip() for line in plan)}")
+        failed = failed or bool(scans)
+    if failed:
+        raise SystemExit(1)
+
+# ------------------------
+# RENTAL CONFIRMATION PDFS
+# ------------------------
+PDF_CACHE_FOLDER = os.path.join(instance_folder, "pdf_cache")
+PDF_CACHE_MAX_FILES = int(os.getenv("PDF_CACHE_MAX_FILES", 500))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+PDF_LAYOUT_VERSION = "1"  # bump when rental_pdfs.py changes so cached files are rebuilt
+os.makedirs(PDF_CACHE_FOLDER, exist_ok=True)
+
+_pdf_cache_lock = threading.Lock()
+
+def rental_pdf_rows(rent_request):
+    """The table that goes into a rental confirmation; also the cache key input."""
+    listing = rent_request.listing
+    return [
+        ["Listing", listing.title],
+        ["Renter", rent_request.renter.username if rent_request.renter else "N/A"],  # renter deleted their account
+        ["Owner", listing.user.username],
+        ["Dates", f"{rent_request.start_date:%d %b %Y} to {rent_request.end_date:%d %b %Y}"],
+        ["Days", str(rent_request.days)],
+        ["Notes", rent_request.description or "N/A"],
+        ["Price per day", f"RM {listing.price:.2f}"],
+        ["Total", f"RM {listing.price * rent_request.days:.2f}"],
+    ]
+
+def _pdf_cache_path(request_id, rows):
+    key = hashlib.sha256(json.dumps([PDF_LAYOUT_VERSION, rows]).encode()).hexdigest()[:16]
+    return os.path.join(PDF_CACHE_FOLDER, f"rental_request_{request_id}_{key}.pdf")
+
+def cached_rental_pdf(request_id, rows):
+    """Return cached PDF bytes for these rows, or None on a miss."""
+    path = _pdf_cache_path(request_id, rows)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(path)  # mark as recently used for eviction
+    return data
+
+def store_rental_pdf(request_id, rows, data):
+    _write_atomic(_pdf_cache_path(request_id, rows), data)
+    evict_pdf_cache()
+
+def get_rental_pdf(rent_request):
+    """Return the confirmation PDF bytes, building and caching them on a miss.
+
+    Files are keyed by the document's content, so an edit to the request,
+    listing or either username can never serve a stale PDF.
+    """
+    rows = rental_pdf_rows(rent_request)
+    data = cached_rental_pdf(rent_request.id, rows)
+    if data is None:
+        data = build_rental_pdf(rows)
+        store_rental_pdf(rent_request.id, rows, data)
+    return data
+
+def invalidate_request_pdfs(request_ids):
+    """Remove cached PDFs for these requests now rather than waiting for eviction."""
+    prefixes = tuple(f"rental_request_{request_id}_" for request_id in request_ids)
+    if not prefixes:
+        return
+    for name in os.listdir(PDF_CACHE_FOLDER):
+        if name.startswith(prefixes):
+            try:
+                os.remove(os.path.join(PDF_CACHE_FOLDER, name))
+            except FileNotFoundError:
+                pass
+
+def invalidate_listing_pdfs(listing_id):
+    request_ids = db.session.query(RentRequest.id).filter_by(listing_id=listing_id, status="Approved")
+    invalidate_request_pdfs([request_id for (request_id,) in request_ids])
+
+def invalidate_user_pdfs(user_id):
+    """Drop cached PDFs that show this user's name, as renter or as owner."""
+    request_ids = db.session.query(RentRequest.id).join(Listing, RentRequest.listing_id == Listing.id).filter(
+        (RentRequest.renter_id == user_id) | (Listing.user_id == user_id),
+        RentRequest.status == "Approved"
+    )
+    invalidate_request_pdfs([request_id for (request_id,) in request_ids])
+
+def evict_pdf_cache():
+    """Delete least recently used PDFs until the cache is within its file and byte limits."""
+    with _pdf_cache_lock:
+        entries = []
+        for entry in os.scandir(PDF_CACHE_FOLDER):
+            if entry.name.endswith(".pdf"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > PDF_CACHE_MAX_FILES or total > PDF_CACHE_MAX_BYTES):
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+# ------------------------
+# BULK PDF EXPORT
+# ------------------------
+# Renderer processes per app worker, so the total is EXPORT_PROCESSES x gunicorn
+# workers; keep it small and raise it only on hosts with cores to spare.
+EXPORT_PROCESSES = int(os.getenv("EXPORT_PROCESSES", 2))
+EXPORT_MAX_DOCUMENTS = int(os.getenv("EXPORT_MAX_DOCUMENTS", 1000))
+# A combined PDF is one ReportLab document, so it renders on a single core while
+# the request waits; ~2 ms a page, so this stays far inside gunicorn's timeout.
+# Larger exports use the streamed ZIP, which renders across the pool.
+EXPORT_PDF_MAX_DOCUMENTS = int(os.getenv("EXPORT_PDF_MAX_DOCUMENTS", 200))
+
+_export_pool = None
+_export_pool_pid = None
+_export_pool_lock = threading.Lock()
+
+def export_pool():
+    """Process pool for rendering PDFs, created on first use in each worker process.
+
+    Renderers are spawned rather than forked: the worker already runs the job
+    and mail threads, and forking a threaded process can copy held locks.
+    """
+    global _export_pool, _export_pool_pid
+    with _export_pool_lock:
+        if _export_pool is None or _export_pool_pid != os.getpid():
+            _export_pool = ProcessPoolExecutor(
+                max_workers=EXPORT_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+            _export_pool_pid = os.getpid()
+        return _export_pool
+
+class _ChunkBuffer:
+    """Write-only file object; zipfile writes into it and the generator drains it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_rental_zip(documents):
+    """Yield a ZIP of confirmations, adding each PDF as soon as it is rendered."""
+    buf = _ChunkBuffer()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        pending = {}
+        for request_id, rows in documents:
+            data = cached_rental_pdf(request_id, rows)
+            if data is None:
+                pending[export_pool().submit(build_rental_pdf, rows)] = (request_id, rows)
+            else:
+                zf.writestr(f"rental_request_{request_id}.pdf", data)
+                yield buf.drain()
+        for future in as_completed(pending):
+            request_id, rows = pending[future]
+            data = future.result()
+            store_rental_pdf(request_id, rows, data)
+            zf.writestr(f"rental_request_{request_id}.pdf", data)
+            yield buf.drain()
+    yield buf.drain()
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+# ------------------------
+# CURRENT USER
+# ------------------------
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 5))  # seconds; 0 turns the cross-request cache off
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+class CachedUser:
+    """Read-only copy of the User columns that templates and permission checks read."""
+    FIELDS = ("id", "username", "email", "profile_pic", "is_admin", "created_at")
+    __slots__ = FIELDS
+
+    def __init__(self, user):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(user, field))
+
+_user_cache = TTLCache(USER_CACHE_TTL, USER_CACHE_SIZE)
+
+def current_user_model():
+    """The logged-in User row, loaded at most once per request. Use this to modify the user."""
+    if "current_user_model" not in g:
+        user_id = session.get("user_id")
+        g.current_user_model = db.session.get(User, user_id) if user_id else None
+    return g.current_user_model
+
+def current_user():
+    """The logged-in user for reading, served from the short-TTL cache when possible."""
+    if "current_user" not in g:
+        user_id = session.get("user_id")
+        user = None
+        if user_id and "current_user_model" not in g:
+            user = _user_cache.get(user_id)
+        if user is None and user_id:
+            model = current_user_model()
+            if model is not None:
+                user = CachedUser(model)
+                _user_cache.set(user_id, user)
+        g.current_user = user
+    return g.current_user
+
+def invalidate_cached_user(user_id):
+    """Drop a user from the cross-request cache after their row changes."""
+    _user_cache.delete(user_id)
+    g.pop("current_user", None)
+
+# ------------------------
+# PASSWORDS AND LOGIN THROTTLING
+# ------------------------
+# Hash cost in Werkzeug's method syntax, e.g. "scrypt:32768:8:1" or
+# "pbkdf2:sha256:600000"; see `flask bench-password-hash` for the CPU cost.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+# Attempts allowed in a burst, then refilled at this many per minute
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", 20))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", 10))
+LOGIN_USER_BURST = int(os.getenv("LOGIN_USER_BURST", 5))
+LOGIN_USER_PER_MINUTE = float(os.getenv("LOGIN_USER_PER_MINUTE", 2))
+# Number of reverse proxies in front of the app; Render (which sets RENDER) has one.
+# 0 trusts no X-Forwarded-For, and then the per-IP limit is off: every request
+# would appear to come from the proxy and share one bucket.
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 1 if os.getenv("RENDER") else 0))
+
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+@functools.lru_cache(maxsize=None)
+def _hash_prefix(method):
+    # Werkzeug fills in default parameters, so compare against what it actually writes
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
+def password_needs_rehash(stored_hash):
+    return stored_hash.split("$", 1)[0] != _hash_prefix(PASSWORD_HASH_METHOD)
+
+class TokenBucketLimiter:
+    """Per-key token buckets: `burst` attempts at once, refilled at `per_minute`.
+
+    State is per process, so each gunicorn worker enforces the limit on its own.
+    Idle buckets are full by definition, so only the most recent `maxsize`
+    keys are remembered.
+    """
+
+    def __init__(self, burst, per_minute, maxsize=100000):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Take one token; returns 0 on success or the seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            elif self.rate > 0:
+                wait = (1 - tokens) / self.rate
+            else:
+                wait = 60
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+login_ip_limiter = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+login_user_limiter = TokenBucketLimiter(LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE)
+
+def throttle_password_attempt(username=None):
+    """Seconds the client must wait before another password attempt, or 0.
+
+    Called before any database or hashing work so throttled requests stay cheap.
+    """
+    wait = login_ip_limiter.acquire(request.remote_addr) if TRUSTED_PROXIES else 0
+    if not wait and username:
+        wait = login_user_limiter.acquire(username.strip().lower())
+    return wait
+
+def too_many_attempts(wait, template, **context):
+    flash(f"Too many attempts. Please try again in {max(int(wait), 1)} seconds.", "error")
+    response = make_response(render_template(template, **context), 429)
+    response.headers["Retry-After"] = str(max(int(wait), 1))
+    return response
+
+@app.cli.command("bench-password-hash")
+@click.option("--method", "methods", multiple=True, help="Hash method to time; repeatable.")
+@click.option("--seconds", default=2.0, help="Time spent on each method.")
+def bench_password_hash_command(methods, seconds):
+    """Report password checks (logins) per second on one core for each hash cost."""
+    methods = methods or (
+        "pbkdf2:sha256:600000", "pbkdf2:sha256:1000000",
+        "scrypt:16384:8:1", "scrypt:32768:8:1", "scrypt:65536:8:1",
+    )
+    if PASSWORD_HASH_METHOD not in methods:
+        methods = (*methods, PASSWORD_HASH_METHOD)
+    for method in methods:
+        stored = generate_password_hash("correct horse battery staple", method=method)
+        checks = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            check_password_hash(stored, "correct horse battery staple")
+            checks += 1
+        elapsed = time.perf_counter() - start
+        marker = " (configured)" if method == PASSWORD_HASH_METHOD else ""
+        print(f"{method:<24} {checks / elapsed:8.1f} logins/s per core  {1000 * elapsed / checks:7.1f} ms each{marker}")
+
+# ------------------------
+# PAGE CACHE
+# ------------------------
+# Anonymous renders of the feed and listing pages are cached under a key made
+# of the content versions they depend on. Versions live in the database, so
+# every gunicorn worker sees a bump as soon as the mutating request commits.
+PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "memory")  # "memory", "filesystem" or "none"
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 60))  # also bounds how stale "x minutes ago" can get
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", 2000))
+PAGE_CACHE_FOLDER = os.path.join(instance_folder, "page_cache")
+
+class FileSystemCache:
+    """Cache backend shared by every worker process on the host."""
+
+    def __init__(self, folder, ttl, maxsize):
+        self.folder = folder
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._writes = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        _write_atomic(self._path(key), value)
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        """Remove expired entries, then the oldest ones beyond maxsize."""
+        entries = []
+        for entry in os.scandir(self.folder):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        cutoff = time.time() - self.ttl
+        excess = len(entries) - self.maxsize
+        for i, (mtime, path) in enumerate(entries):
+            if mtime >= cutoff and i >= excess:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+def make_page_cache(backend):
+    if backend == "filesystem":
+        return FileSystemCache(PAGE_CACHE_FOLDER, PAGE_CACHE_TTL, PAGE_CACHE_SIZE)
+    if backend == "memory":
+        return TTLCache(PAGE_CACHE_TTL, PAGE_CACHE_SIZE)
+    return NullCache()
+
+page_cache = make_page_cache(PAGE_CACHE_BACKEND)
+
+def bump_versions(*keys):
+    """Invalidate cached pages that depend on these keys, in the caller's transaction."""
+    now = datetime.utcnow()
+    for key in keys:
+        increment_counters(ContentVersion, {"key": key}, {"version": 1}, updated_at=now)
+
+def _page_is_cacheable():
+    # Logged-in pages differ per user, and pending flashes must be shown exactly once
+    return request.method == "GET" and "user_id" not in session and "_flashes" not in session
+
+def cached_page(version_keys):
+    """Serve anonymous GETs from the page cache and answer conditional requests with 304.
+
+    version_keys(**view_args) lists the ContentVersion keys the page depends on.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if not _page_is_cacheable():
+                return view(**kwargs)
+
+            keys = version_keys(**kwargs)
+            rows = ContentVersion.query.filter(ContentVersion.key.in_(keys)).all()
+            versions = {row.key: row.version for row in rows}
+            # Time bucket: relative timestamps in the page must not go stale for long
+            bucket = int(time.time() // PAGE_CACHE_TTL) if PAGE_CACHE_TTL else 0
+            etag = hashlib.sha256(
+                repr((request.full_path, bucket, [versions.get(key, 0) for key in keys])).encode()
+            ).hexdigest()[:32]
+            last_modified = max(
+                [row.updated_at for row in rows] + [datetime.utcfromtimestamp(bucket * PAGE_CACHE_TTL)]
+            ).replace(microsecond=0)
+
+            probe = Response(status=200)
+            probe.set_etag(etag)
+            probe.last_modified = last_modified
+            probe.cache_control.no_cache = True  # always revalidate; usually a cheap 304
+            probe.make_conditional(request)
+            if probe.status_code == 304:
+                return probe
+
+            body = page_cache.get(etag)
+            if body is None:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                page_cache.set(etag, body)
+            response = Response(body, mimetype="text/html")
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+# ------------------------
+# METRICS
+# ------------------------
+# Per-endpoint request latency and SQL usage, exposed at /metrics in the
+# Prometheus text format. Counters live in each worker process; a scrape sees
+# the worker that answered it, so aggregate with sum() across scrapes/instances.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 20))  # queries per request
+# Scrapers send "Authorization: Bearer <METRICS_TOKEN>"; without a token set,
+# only a logged-in admin can read /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestMetrics:
+    """Thread-safe counters and latency histograms keyed by endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()  # (endpoint, method, status) -> requests
+        self.latency = {}  # endpoint -> [count per bucket..., +Inf count, sum of seconds]
+        self.queries = Counter()  # endpoint -> SQL statements
+        self.sql_seconds = Counter()  # endpoint -> seconds spent in SQL
+        self.slow_queries = Counter()  # endpoint -> statements slower than SLOW_QUERY_MS
+        self.n_plus_one = Counter()  # endpoint -> requests over N_PLUS_ONE_THRESHOLD queries
+
+    def observe_request(self, endpoint, method, status, seconds, queries, sql_seconds):
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            histogram = self.latency.setdefault(endpoint, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            self.queries[endpoint] += queries
+            self.sql_seconds[endpoint] += sql_seconds
+            if queries > N_PLUS_ONE_THRESHOLD:
+                self.n_plus_one[endpoint] += 1
+
+    def observe_slow_query(self, endpoint):
+        with self._lock:
+            self.slow_queries[endpoint] += 1
+
+    def render(self):
+        """Prometheus text exposition of everything recorded so far."""
+        def label(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = []
+        def counter(name, help_text, values, labels=("endpoint",)):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(values.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                pairs = ",".join(f'{l}="{label(v)}"' for l, v in zip(labels, key))
+                lines.append(f"{name}{{{pairs}}} {value}")
+
+        with self._lock:
+            counter("rented_http_requests_total", "HTTP requests handled.", self.requests,
+                    ("endpoint", "method", "status"))
+            lines.append("# HELP rented_http_request_duration_seconds Time spent handling requests.")
+            lines.append("# TYPE rented_http_request_duration_seconds histogram")
+            for endpoint, histogram in sorted(self.latency.items()):
+                name = f'rented_http_request_duration_seconds_bucket{{endpoint="{label(endpoint)}"'
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+                    lines.append(f'{name},le="{bound}"}} {count}')
+                lines.append(f'{name},le="+Inf"}} {histogram[-2]}')
+                lines.append(f'rented_http_request_duration_seconds_sum{{endpoint="{label(endpoint)}"}} {histogram[-1]}')
+                lines.append(f'rented_http_request_duration_seconds_count{{endpoint="{label(endpoint)}"}} {histogram[-2]}')
+            counter("rented_db_queries_total", "SQL statements executed while handling requests.", self.queries)
+            counter("rented_db_query_seconds_total", "Time spent in SQL while handling requests.", self.sql_seconds)
+            counter("rented_db_slow_queries_total", f"SQL statements slower than {SLOW_QUERY_MS:g} ms.",
+                    self.slow_queries)
+            counter("rented_n_plus_one_requests_total",
+                    f"Requests that ran more than {N_PLUS_ONE_THRESHOLD} SQL statements.", self.n_plus_one)
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    endpoint = "-"
+    if has_request_context():
+        endpoint = request.endpoint or "-"
+        stats = g.get("query_stats")
+        if stats is not None:
+            stats["count"] += 1
+            stats["seconds"] += elapsed
+            stats["statements"][statement] += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        route = f"{request.method} {request.path}" if has_request_context() else "background"
+        app.logger.warning("Slow query (%.0f ms) on %s: %s", elapsed * 1000, route, " ".join(statement.split()))
+        request_metrics.observe_slow_query(endpoint)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.query_stats = {"count": 0, "seconds": 0.0, "statements": Counter()}
+
+@app.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    started = g.get("request_started")
+    stats = g.get("query_stats")
+    if started is None or stats is None:
+        return
+    endpoint = request.endpoint or "unmatched"
+    status = 500 if exc is not None else g.get("response_status", 200)
+    request_metrics.observe_request(
+        endpoint, request.method, status, time.perf_counter() - started, stats["count"], stats["seconds"]
+    )
+    if stats["count"] > N_PLUS_ONE_THRESHOLD:
+        statement, repeats = stats["statements"].most_common(1)[0]
+        app.logger.warning(
+            "Possible N+1 on %s %s (%s): %d queries, the most repeated ran %d times: %s",
+            request.method, request.path, endpoint, stats["count"], repeats, " ".join(statement.split())
+        )
+
+# ------------------------
+# JSON API
+# ------------------------
+# Read-only JSON for integrations and mobile clients. Lists are keyset-paginated:
+# each page carries "next_cursor", sent back as ?cursor= for the next one.
+# ?fields=a,b picks the fields returned, and only those columns are read.
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", 50))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 200))
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", 1000))  # rows per server-side cursor fetch
+
+LISTING_API_FIELDS = {
+    "id": Listing.id,
+    "title": Listing.title,
+    "description": Listing.description,
+    "price": Listing.price,
+    "image": Listing.image,
+    "is_rented": Listing.is_rented,
+    "created_at": Listing.created_at,
+    "owner_id": Listing.user_id,
+    "owner": User.username,
+}
+LISTING_API_DEFAULT = ("id", "title", "price", "is_rented", "created_at", "owner_id")
+
+REQUEST_API_FIELDS = {
+    "id": RentRequest.id,
+    "listing_id": RentRequest.listing_id,
+    "status": RentRequest.status,
+    "start_date": RentRequest.start_date,
+    "end_date": RentRequest.end_date,
+    "days": RentRequest.days,
+    "created_at": RentRequest.created_at,
+    "renter_id": RentRequest.renter_id,
+    "description": RentRequest.description,
+}
+REQUEST_API_DEFAULT = ("id", "listing_id", "status", "start_date", "end_date", "days")
+# Only for the listing owner, the renter and admins
+REQUEST_API_PRIVATE = {"renter_id", "description"}
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+@app.errorhandler(ApiError)
+def handle_api_error(e):
+    return jsonify(error=e.message), e.status
+
+def api_fields(available, default, private=(), show_private=True):
+    """Field names from ?fields=, or the defaults."""
+    requested = request.args.get("fields")
+    names = [name.strip() for name in requested.split(",") if name.strip()] if requested else list(default)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}")
+    if not show_private and any(name in private for name in names):
+        raise ApiError(f"Only the owner can read: {', '.join(sorted(private))}", 403)
+    return list(dict.fromkeys(names))
+
+def api_limit():
+    return min(max(request.args.get("limit", API_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+
+def api_select(available, names, keys):
+    """SELECT of just the named columns, plus the keys that pagination needs."""
+    return select(*[available[name].label(name) for name in dict.fromkeys([*keys, *names])])
+
+def api_record(row, names):
+    record = {}
+    for name in names:
+        value = getattr(row, name)
+        if name == "image":
+            value = url_for("static", filename=static_image_path("listing", value or "default_listing.png"))
+        elif isinstance(value, date):  # also datetime
+            value = value.isoformat()
+        record[name] = value
+    return record
+
+def listings_statement(names, keys):
+    statement = api_select(LISTING_API_FIELDS, names, keys).select_from(Listing)
+    if "owner" in names:
+        statement = statement.outerjoin(User, Listing.user_id == User.id)
+    return statement
+
+def api_request_page(names, *filters):
+    """One page of rent requests, newest first; the cursor is the last id."""
+    limit = api_limit()
+    statement = api_select(REQUEST_API_FIELDS, names, ["id"]).where(*filters)
+    if request.args.get("status"):
+        statement = statement.where(RentRequest.status == request.args["status"])
+    cursor = request.args.get("cursor")
+    if cursor:
+        if not cursor.isdigit():
+            raise ApiError("Invalid cursor")
+        statement = statement.where(RentRequest.id < int(cursor))
+    rows = db.session.execute(statement.order_by(RentRequest.id.desc()).limit(limit + 1)).all()
+    next_cursor = str(rows[limit - 1].id) if len(rows) > limit else None
+    return jsonify(data=[api_record(row, names) for row in rows[:limit]], next_cursor=next_cursor)
+
+def stream_ndjson(statement, names):
+    """Yield the statement's rows as NDJSON, one chunk per server-side cursor batch."""
+    result = db.session.execute(statement.execution_options(yield_per=EXPORT_YIELD_PER))
+    for rows in result.partitions():
+        yield "".join(json.dumps(api_record(row, names), separators=(",", ":")) + "\n" for row in rows)
+
 # ------------------------
 # ROUTES
 # ------------------------
 @app.route("/")
+@cached_page(lambda: ["feed"])
 def home():
-    listings = Listing.query.order_by(Listing.created_at.desc()).all()
-    # Mark listings that are rented (have any approved request)
-    for listing in listings:
-        listing.is_rented = any(req.status == "Approved" for req in listing.requests)
-    return render_template("index.html", listings=listings)
+    query = (
+        Listing.query
+        .options(joinedload(Listing.user))
+        .order_by(Listing.created_at.desc(), Listing.id.desc())
+    )
+
+    # Keyset pagination: continue strictly after the last card of the previous page
+    cursor = decode_feed_cursor(request.args.get("before"))
+    if cursor:
+        query = query.filter(tuple_(Listing.created_at, Listing.id) < tuple_(*cursor))
+
+    rows = query.limit(FEED_PAGE_SIZE + 1).all()
+    listings = rows[:FEED_PAGE_SIZE]
+    next_url = None
+    if len(rows) > FEED_PAGE_SIZE:
+        next_url = url_for("home", before=encode_feed_cursor(listings[-1]))
+    return render_template("index.html", listings=listings, next_url=next_url, search={})
+
+@app.route("/search")
+def search():
+    terms = request.args.get("q", "").strip()
+    min_price = request.args.get("min_price", type=float)
+    max_price = request.args.get("max_price", type=float)
+    availability = request.args.get("availability")
+    page = max(request.args.get("page", 1, type=int), 1)
+    listings, has_next, facets = search_listings(terms, min_price, max_price, availability, page)
+    next_url = url_for("search", **{**request.args.to_dict(), "page": page + 1}) if has_next else None
+    return render_template(
+        "index.html",
+        listings=listings,
+        next_url=next_url,
+        search={
+            "q": terms,
+            "min_price": min_price,
+            "max_price": max_price,
+            "availability": availability or "",
+            "facets": facets,
+        }
+    )
 
 # --- Auth Routes ---
 @app.route("/signup", methods=["GET", "POST"])
@@ -175,12 +2759,15 @@ def signup():
         username = request.form.get("username")
         email = request.form.get("email")
         password = request.form.get("password")
+        wait = throttle_password_attempt()
+        if wait:
+            return too_many_attempts(wait, "signup.html", error=None)
         if User.query.filter_by(username=username).first():
             error = "Username already exists!"
         elif email and User.query.filter_by(email=email).first():
             error = "Email already exists!"
         else:
-            hashed_password = generate_password_hash(password)
+            hashed_password = hash_password(password)
             new_user = User(username=username, email=email, password=hashed_password)
             db.session.add(new_user)
             db.session.commit()
@@ -194,8 +2781,15 @@ def login():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
+        wait = throttle_password_attempt(username)
+        if wait:
+            return too_many_attempts(wait, "login.html", error=None)
         user = User.query.filter_by(username=username).first()
         if user and check_password_hash(user.password, password):
+            if password_needs_rehash(user.password):
+                # Hash cost was changed since this password was set
+                user.password = hash_password(password)
+                db.session.commit()
             session["user_id"] = user.id
             session["username"] = user.username
             session["is_admin"] = user.is_admin
@@ -220,18 +2814,20 @@ def logout():
 def profile():
     if "user_id" not in session:
         return redirect(url_for("login"))
-    user = User.query.get(session["user_id"])
+    user = current_user()
     return render_template("profile.html", user=user)
 
 @app.route("/update-profile", methods=["POST"])
 def update_profile():
     if "user_id" not in session:
         return redirect(url_for("login"))
-    user = User.query.get(session["user_id"])
+    user = current_user_model()
     username = request.form.get("username")
     email = request.form.get("email")
     profile_pic = request.files.get("profile_pic")
     if username:
+        if username != user.username:
+            invalidate_user_pdfs(user.id)
         user.username = username
         session["username"] = username
     if email:
@@ -241,11 +2837,16 @@ def update_profile():
             return redirect(url_for("profile"))
         user.email = email
     if profile_pic and profile_pic.filename:
-        filename = secure_filename(profile_pic.filename)
-        save_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        profile_pic.save(save_path)
-        user.profile_pic = f"profile_pics/{filename}"
+        try:
+            staged = stage_upload(profile_pic)
+        except INVALID_IMAGE_ERRORS:
+            flash("Please upload a valid image file.", "error")
+            return redirect(url_for("profile"))
+        # The current picture stays until the worker swaps in the processed one
+        enqueue_image_processing("user", user.id, staged)
+    bump_versions("feed", "profiles")
     db.session.commit()
+    invalidate_cached_user(user.id)
     flash("Profile updated successfully!", "success")
     return redirect(url_for("profile"))
 
@@ -253,18 +2854,23 @@ def update_profile():
 def update_password():
     if "user_id" not in session:
         return redirect(url_for("login"))
-    user = User.query.get(session["user_id"])
+    user = current_user_model()
     current_password = request.form.get("current_password")
     new_password = request.form.get("new_password")
     confirm_password = request.form.get("confirm_password")
+    wait = throttle_password_attempt(user.username)
+    if wait:
+        flash(f"Too many attempts. Please try again in {max(int(wait), 1)} seconds.", "error")
+        return redirect(url_for("profile"))
     if not check_password_hash(user.password, current_password):
         flash("Current password is incorrect.", "error")
         return redirect(url_for("profile"))
     if new_password != confirm_password:
         flash("New password and confirmation do not match.", "error")
         return redirect(url_for("profile"))
-    user.password = generate_password_hash(new_password)
+    user.password = hash_password(new_password)
     db.session.commit()
+    invalidate_cached_user(user.id)
     flash("Password updated successfully!", "success")
     return redirect(url_for("profile"))
 
@@ -272,9 +2878,9 @@ def update_password():
 def delete_account():
     if "user_id" not in session:
         return redirect(url_for("login"))
-    user = User.query.get(session["user_id"])
-    db.session.delete(user)
+    delete_user_records(current_user_model())
     db.session.commit()
+    invalidate_cached_user(session["user_id"])
     session.clear()
     flash("Your account has been deleted.", "success")
     return redirect(url_for("home"))
@@ -294,21 +2900,27 @@ def create_listing():
         except Exception:
             price_value = 0.0
         image_file = request.files.get("image")
-        image_filename = None
+        staged = None
         if image_file and image_file.filename != "":
-            filename = secure_filename(image_file.filename)
-            save_path = os.path.join(app.config["LISTING_FOLDER"], filename)
-            image_file.save(save_path)
-            image_filename = filename
-        image_to_store = image_filename if image_filename else "default_listing.png"
+            try:
+                staged = stage_upload(image_file)
+            except INVALID_IMAGE_ERRORS:
+                flash("Please upload a valid image file.", "error")
+                return redirect(url_for("create_listing"))
+        # Shows the default image until the worker has processed the upload
         new_listing = Listing(
             title=title,
             description=description,
             price=price_value,
-            image=image_to_store,
+            image="default_listing.png",
             user_id=session["user_id"]
         )
         db.session.add(new_listing)
+        index_listing(new_listing)
+        bump_versions("feed")
+        if staged:
+            db.session.flush()
+            enqueue_image_processing("listing", new_listing.id, staged)
         db.session.commit()
         flash("Listing created successfully!", "success")
         return redirect(url_for("home"))
@@ -319,23 +2931,36 @@ def edit_listing(id):
     if "user_id" not in session:
         return redirect(url_for("login"))
     listing = Listing.query.get_or_404(id)
-    user = User.query.get(session["user_id"])
+    user = current_user()
     if listing.user_id != session["user_id"] and not user.is_admin:
         return "Unauthorized", 403
     if request.method == "POST":
+        invalidate_listing_pdfs(listing.id)
         listing.title = request.form["title"]
         listing.description = request.form["description"]
         price = request.form["price"]
+        old_price = listing.price
         try:
             listing.price = float(price)
         except Exception:
             pass
+        if listing.price != old_price:
+            # Revenue of approved requests follows the listing price
+            approved = [r for r in listing.requests if r.status == "Approved"]
+            record_rental_stats(
+                added=[rental_stats_row(r, listing) for r in approved],
+                removed=[rental_stats_row(r, listing)[:4] + (old_price,) for r in approved],
+            )
         image_file = request.files.get("image")
         if image_file and image_file.filename != "":
-            filename = secure_filename(image_file.filename)
-            save_path = os.path.join(app.config["LISTING_FOLDER"], filename)
-            image_file.save(save_path)
-            listing.image = filename
+            try:
+                enqueue_image_processing("listing", listing.id, stage_upload(image_file))
+            except INVALID_IMAGE_ERRORS:
+                db.session.rollback()
+                flash("Please upload a valid image file.", "error")
+                return redirect(url_for("edit_listing", id=listing.id))
+        index_listing(listing)
+        bump_versions("feed", f"listing:{listing.id}")
         db.session.commit()
         flash("Listing updated successfully!", "success")
         return redirect(url_for("home"))
@@ -346,63 +2971,84 @@ def delete_user(user_id):
     if "user_id" not in session:
         return redirect(url_for("login"))
 
-    admin_user = User.query.get(session["user_id"])
+    admin_user = current_user()
     if not admin_user.is_admin:
         return "Unauthorized", 403
 
     user = User.query.get_or_404(user_id)
 
-    # Cascade delete will handle listings + requests automatically
-    db.session.delete(user)
+    # The database cascades to listings + requests; files are removed in the background
+    delete_user_records(user)
     db.session.commit()
+    invalidate_cached_user(user_id)
 
     flash("User and all their information have been deleted successfully!", "success")
     return redirect(url_for("admin_dashboard"))
 
 # --- Rent Request ---
 @app.route("/listing/<int:id>", methods=["GET", "POST"])
+@cached_page(lambda id: [f"listing:{id}", "profiles"])
 def view_listing(id):
     listing = Listing.query.get_or_404(id)
 
-    # Check if there is any approved request
-    approved_request = next((req for req in listing.requests if req.status == "Approved"), None)
-
     if request.method == "POST":
-        # If already rented, prevent new requests
-        if approved_request:
-            flash("This listing is already rented. You cannot send a request.", "error")
-            return redirect(url_for("view_listing", id=listing.id))
-
         if "user_id" not in session:
             flash("You must be logged in to send a request.", "error")
             return redirect(url_for("login"))
+        try:
+            start_date, end_date = parse_booking_dates(request.form)
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("view_listing", id=listing.id))
+
+        # Re-read under the lock so a concurrent approval cannot slip in between
+        listing = lock_listing(listing.id) or abort(404)
+        if booking_conflict(listing.id, start_date, end_date):
+            flash("Those dates overlap a confirmed booking. Please pick free dates from the calendar.", "error")
+            return redirect(url_for("view_listing", id=listing.id))
 
         existing_request = RentRequest.query.filter_by(
             listing_id=listing.id,
-            renter_id=session["user_id"]
+            renter_id=session["user_id"],
+            status="Pending"
         ).first()
         if existing_request:
-            flash("You already have a request for this listing. You can edit or delete it.", "warning")
+            flash("You already have a pending request for this listing. You can edit or delete it.", "warning")
             return redirect(url_for("view_listing", id=listing.id))
 
-        days = request.form.get("days")
         description = request.form.get("description")
         new_request = RentRequest(
-            days=int(days) if days else 1,
+            start_date=start_date,
+            end_date=end_date,
+            days=(end_date - start_date).days,
             description=description,
             listing_id=listing.id,
             renter_id=session["user_id"]
         )
         db.session.add(new_request)
+        db.session.flush()
+        record_rental_stats(added=[rental_stats_row(new_request, listing)])
+        notify_owner(listing, new_request, "created")
+        bump_versions(f"listing:{listing.id}")
         db.session.commit()
         flash("Your rental request has been sent!", "success")
         return redirect(url_for("view_listing", id=listing.id))
 
+    # Bookings that have not ended yet; past ones only matter to the stats and PDFs
+    today = datetime.utcnow().date()
+    requests = (
+        RentRequest.query.options(joinedload(RentRequest.renter))
+        .filter(RentRequest.listing_id == listing.id, RentRequest.end_date > today)
+        .order_by(RentRequest.start_date, RentRequest.id)
+        .all()
+    )
     return render_template(
         "view_listing.html",
         listing=listing,
-        requests=listing.requests,
-        approved_request=approved_request,  # pass to template
+        requests=requests,
+        approved_requests=[r for r in requests if r.status == "Approved"],
+        availability=availability_calendar(listing.id, today),
+        today=today,
         current_time=datetime.utcnow()       # so templates can compute timeago
     )
 
@@ -413,9 +3059,28 @@ def edit_request(request_id):
         return "Unauthorized", 403
 
     if request.method == "POST":
-        rent_request.days = int(request.form.get("days", rent_request.days))
+        try:
+            start_date, end_date = parse_booking_dates(request.form)
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("edit_request", request_id=rent_request.id))
+        lock_listing(rent_request.listing_id)
+        db.session.refresh(rent_request)
+        if booking_conflict(rent_request.listing_id, start_date, end_date, exclude_id=rent_request.id):
+            db.session.rollback()
+            flash("Those dates overlap a confirmed booking. Please pick free dates from the calendar.", "error")
+            return redirect(url_for("edit_request", request_id=rent_request.id))
+        before = rental_stats_row(rent_request, rent_request.listing)
+        rent_request.start_date = start_date
+        rent_request.end_date = end_date
+        rent_request.days = (end_date - start_date).days
         rent_request.description = request.form.get("description", rent_request.description)
         rent_request.status = "Pending"  # Reset status on edit
+        record_rental_stats(added=[rental_stats_row(rent_request, rent_request.listing)], removed=[before])
+        invalidate_request_pdfs([rent_request.id])
+        sync_rental_state(rent_request.listing_id)
+        notify_owner(rent_request.listing, rent_request, "edited")
+        bump_versions("feed", f"listing:{rent_request.listing_id}")
         db.session.commit()
         flash("Request updated and reset to Pending.", "success")
         return redirect(url_for("view_listing", id=rent_request.listing_id))
@@ -429,7 +3094,12 @@ def delete_request(request_id):
     if "user_id" not in session or rent_request.renter_id != session["user_id"]:
         return "Unauthorized", 403
     listing_id = rent_request.listing_id
+    lock_listing(listing_id)
+    db.session.refresh(rent_request)
+    record_rental_stats(removed=[rental_stats_row(rent_request, rent_request.listing)])
     db.session.delete(rent_request)
+    sync_rental_state(listing_id)
+    bump_versions("feed", f"listing:{listing_id}")
     db.session.commit()
     flash("Your rental request has been deleted.", "info")
     return redirect(url_for("view_listing", id=listing_id))
@@ -442,12 +3112,17 @@ def approve_request(request_id):
     if "user_id" not in session or session["user_id"] != listing.user_id:
         return "Unauthorized", 403
 
-    # Decline all other requests
-    for r in listing.requests:
-        if r.id != rent_request.id:
-            r.status = "Declined"
-
-    rent_request.status = "Approved"
+    try:
+        listing = approve_rent_request(rent_request.id)
+    except BookingConflict:
+        db.session.rollback()
+        flash("Those dates overlap a booking you already approved.", "error")
+        return redirect(url_for("view_listing", id=rent_request.listing_id))
+    if listing is None:
+        db.session.rollback()
+        flash("That request no longer exists.", "error")
+        return redirect(url_for("home"))
+    bump_versions("feed", f"listing:{listing.id}")
     db.session.commit()
     flash("Request approved! PDF now available.", "success")
     return redirect(url_for("view_listing", id=listing.id))
@@ -457,7 +3132,7 @@ def delete_listing(id):
     listing = Listing.query.get_or_404(id)
 
     try:
-        db.session.delete(listing)
+        delete_listing_records(listing)
         db.session.commit()
         flash("Listing deleted successfully!", "success")
     except Exception as e:
@@ -480,56 +3155,70 @@ def request_pdf(request_id):
         flash("PDF is only available for approved requests.", "error")
         return redirect(url_for("view_listing", id=listing.id))
 
-    pdf_filename = f"rental_request_{rent_request.id}.pdf"
-    pdf_path = os.path.join("instance", pdf_filename)
-
-    # --- PDF Generation ---
-    doc = SimpleDocTemplate(pdf_path, pagesize=letter)
-    styles = getSampleStyleSheet()
-    elements = []
-
-    # Title
-    elements.append(Paragraph("<b>Rental Confirmation</b>", styles["Title"]))
-    elements.append(Spacer(1, 20))
-
-    # Logo (optional)
-    logo_path = os.path.join("static", "images", "logo.png")
-    if os.path.exists(logo_path):
-        elements.append(Image(logo_path, width=120, height=60))
-        elements.append(Spacer(1, 20))
-
-    # Rental details
-    data = [
-        ["Listing", listing.title],
-        ["Renter", rent_request.renter.username],
-        ["Owner", listing.user.username],
-        ["Days", str(rent_request.days)],
-        ["Notes", rent_request.description or "N/A"],
-        ["Price per day", f"RM {listing.price:.2f}"],
-        ["Total", f"RM {listing.price * rent_request.days:.2f}"],
-    ]
+    return send_file(
+        io.BytesIO(get_rental_pdf(rent_request)),
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=f"rental_request_{rent_request.id}.pdf"
+    )
 
-    table = Table(data, colWidths=[150, 350])
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#4CAF50")),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
-        ("GRID", (0, 0), (-1, -1), 1, colors.black),
-    ]))
-
-    elements.append(table)
-    elements.append(Spacer(1, 30))
-
-    # Footer
-    elements.append(Paragraph(
-        "Thank you for using Rented! Please keep this document as proof of your rental agreement.",
-        styles["Normal"]
-    ))
+@app.route("/export_pdfs")
+def export_pdfs():
+    if "user_id" not in session:
+        return redirect(url_for("login"))
+    user = current_user()
 
-    doc.build(elements)
-    return send_file(pdf_path, as_attachment=True)
+    # Owners export their own rentals; admins may pick any owner or all of them
+    owner_id = request.args.get("owner_id", type=int)
+    if not user.is_admin:
+        if owner_id not in (None, user.id):
+            return "Unauthorized", 403
+        owner_id = user.id
+    try:
+        start = parse_date_arg("start")
+        end = parse_date_arg("end")
+    except ValueError:
+        return "Dates must be YYYY-MM-DD", 400
+
+    query = (
+        RentRequest.query
+        .join(RentRequest.listing)
+        .options(contains_eager(RentRequest.listing).joinedload(Listing.user), joinedload(RentRequest.renter))
+        .filter(RentRequest.status == "Approved")
+        .order_by(RentRequest.id)
+    )
+    if owner_id:
+        query = query.filter(Listing.user_id == owner_id)
+    # Rentals whose booked dates overlap the inclusive [start, end] range
+    if start:
+        query = query.filter(RentRequest.end_date > start)
+    if end:
+        query = query.filter(RentRequest.start_date < end + timedelta(days=1))
+    combined = request.args.get("format") == "pdf"
+    limit = EXPORT_PDF_MAX_DOCUMENTS + 1 if combined else EXPORT_MAX_DOCUMENTS
+    documents = [(r.id, rental_pdf_rows(r)) for r in query.limit(limit)]
+
+    if not documents:
+        flash("No approved rentals match that export.", "info")
+        return redirect(url_for("admin_dashboard" if user.is_admin else "profile"))
+
+    if combined:
+        if len(documents) > EXPORT_PDF_MAX_DOCUMENTS:
+            flash(f"A single PDF holds at most {EXPORT_PDF_MAX_DOCUMENTS} rentals; "
+                  "narrow the dates or download the ZIP.", "error")
+            return redirect(url_for("admin_dashboard" if user.is_admin else "profile"))
+        data = export_pool().submit(build_combined_rental_pdf, [rows for _, rows in documents]).result()
+        return send_file(
+            io.BytesIO(data),
+            mimetype="application/pdf",
+            as_attachment=True,
+            download_name="rental_confirmations.pdf"
+        )
+    return Response(
+        stream_rental_zip(documents),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=rental_confirmations.zip"}
+    )
 
 @app.route("/decline_request/<int:request_id>", methods=["POST"])
 def decline_request(request_id):
@@ -539,9 +3228,15 @@ def decline_request(request_id):
     if "user_id" not in session or session["user_id"] != listing.user_id:
         return "Unauthorized", 403
 
+    lock_listing(listing.id)
+    db.session.refresh(rent_request)
+    before = rental_stats_row(rent_request, listing)
     rent_request.status = "Declined"
+    record_rental_stats(added=[rental_stats_row(rent_request, listing)], removed=[before])
+    sync_rental_state(listing.id)
+    bump_versions("feed", f"listing:{listing.id}")
     db.session.commit()
-    flash("Request declined. Approve/Decline buttons are now hidden.", "info")
+    flash("Request declined.", "info")
     return redirect(url_for("view_listing", id=listing.id))
 
 
@@ -551,17 +3246,51 @@ def decline_request(request_id):
 def admin_dashboard():
     if "user_id" not in session:
         return redirect(url_for("login"))
-    user = User.query.get(session["user_id"])
+    user = current_user()
     if not user.is_admin:
         return "Access denied", 403
-    users = User.query.all()
-    return render_template("admin_dashboard.html", users=users, title="Admin Dashboard")
+
+    search = request.args.get("q", "").strip()
+    sort = request.args.get("sort", "id")
+    if sort not in ADMIN_SORTS:
+        sort = "id"
+    descending = request.args.get("dir") == "desc"
+    page = max(request.args.get("page", 1, type=int), 1)
+    users, has_next = admin_user_rows(search, sort, descending, page)
+
+    def page_url(**changes):
+        args = {"q": search or None, "sort": sort, "dir": "desc" if descending else "asc", "page": page}
+        args.update(changes)
+        return url_for("admin_dashboard", **{k: v for k, v in args.items() if v})
+
+    return render_template(
+        "admin_dashboard.html",
+        users=users,
+        search=search,
+        sort=sort,
+        descending=descending,
+        page=page,
+        prev_url=page_url(page=page - 1) if page > 1 else None,
+        next_url=page_url(page=page + 1) if has_next else None,
+        page_url=page_url,
+        title="Admin Dashboard"
+    )
+
+@app.route("/admin/analytics")
+def analytics():
+    if "user_id" not in session:
+        return redirect(url_for("login"))
+    if not current_user().is_admin:
+        return "Access denied", 403
+    days = min(max(request.args.get("days", ANALYTICS_DEFAULT_DAYS, type=int), 1), 366)
+    totals, daily, owners = rental_analytics(days)
+    return render_template("analytics.html", totals=totals, daily=daily, owners=owners, days=days)
 
 @app.route("/create_user", methods=["GET", "POST"])
 def create_user():
     if "user_id" not in session:
         return redirect(url_for("login"))
-    admin_user = User.query.get(session["user_id"])
+    admin_user = current_user()
     if not admin_user.is_admin:
         return "Unauthorized", 403
     if request.method == "POST":
@@ -574,7 +3303,7 @@ def create_user():
         elif email and User.query.filter_by(email=email).first():
             flash("Email already exists!", "error")
         else:
-            hashed_password = generate_password_hash(password)
+            hashed_password = hash_password(password)
             new_user = User(username=username, email=email, password=hashed_password, is_admin=is_admin)
             db.session.add(new_user)
             db.session.commit()
@@ -586,16 +3315,20 @@ def create_user():
 def edit_user(user_id):
     if "user_id" not in session:
         return redirect(url_for("login"))
-    admin_user = User.query.get(session["user_id"])
+    admin_user = current_user()
     if not admin_user.is_admin:
         return "Unauthorized", 403
     user = User.query.get_or_404(user_id)
     if request.method == "POST":
+        if request.form.get("username", user.username) != user.username:
+            invalidate_user_pdfs(user.id)
         user.username = request.form.get("username", user.username)
         password = request.form.get("password")
         if password:
-            user.password = generate_password_hash(password)
+            user.password = hash_password(password)
+        bump_versions("feed", "profiles")
         db.session.commit()
+        invalidate_cached_user(user.id)
         flash("User updated successfully!", "success")
         return redirect(url_for("admin_dashboard"))
     return render_template("edit_user.html", user=user, title="Edit User")
@@ -615,47 +3348,159 @@ def send_email():
     if not name or not email or not subject or not message_body:
         return render_template("contact.html", message="Please fill in all fields.", success=False)
     try:
-        admin_msg = MIMEText(f"From: {name} <{email}>\n\n{message_body}")
-        admin_msg["Subject"] = f"Contact Form: {subject}"
-        admin_msg["From"] = ADMIN_EMAIL
-        admin_msg["To"] = ADMIN_EMAIL
-        auto_reply = MIMEText(
+        queue_email(ADMIN_EMAIL, f"Contact Form: {subject}", f"From: {name} <{email}>\n\n{message_body}")
+        queue_email(
+            email,
+            "Thank you for contacting Rented!",
             f"Hello {name},\n\n"
             "Thank you for contacting us! We have received your message and will get back to you shortly.\n\n"
             "Best regards,\nRented Team"
         )
-        auto_reply["Subject"] = "Thank you for contacting Rented!"
-        auto_reply["From"] = ADMIN_EMAIL
-        auto_reply["To"] = email
-        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10)
-        server.starttls()
-        server.login(ADMIN_EMAIL, ADMIN_PASSWORD)
-        server.sendmail(ADMIN_EMAIL, ADMIN_EMAIL, admin_msg.as_string())
-        server.sendmail(ADMIN_EMAIL, email, auto_reply.as_string())
-        server.quit()
+        db.session.commit()
         return render_template("contact.html", message="Your message has been sent successfully!", success=True)
-    except Exception as e:
-        print("Email error:", e)
+    except Exception:
+        db.session.rollback()
+        app.logger.exception("Failed to queue contact form emails")
         return render_template("contact.html", message="Failed to send email. Please try again later.", success=False)
 
+# --- JSON API ---
+@app.route("/api/listings")
+def api_listings():
+    names = api_fields(LISTING_API_FIELDS, LISTING_API_DEFAULT)
+    limit = api_limit()
+    # Same keyset order and cursor format as the home feed
+    statement = listings_statement(names, ["created_at", "id"])
+    owner_id = request.args.get("owner_id", type=int)
+    if owner_id:
+        statement = statement.where(Listing.user_id == owner_id)
+    cursor = request.args.get("cursor")
+    if cursor:
+        decoded = decode_feed_cursor(cursor)
+        if decoded is None:
+            raise ApiError("Invalid cursor")
+        statement = statement.where(tuple_(Listing.created_at, Listing.id) < tuple_(*decoded))
+    statement = statement.order_by(Listing.created_at.desc(), Listing.id.desc()).limit(limit + 1)
+    rows = db.session.execute(statement).all()
+    next_cursor = encode_feed_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return jsonify(data=[api_record(row, names) for row in rows[:limit]], next_cursor=next_cursor)
+
+@app.route("/api/listings/<int:id>/requests")
+def api_listing_requests(id):
+    owner_id = db.session.query(Listing.user_id).filter_by(id=id).scalar()
+    if owner_id is None:
+        raise ApiError("Listing not found", 404)
+    user = current_user()
+    show_private = bool(user and (user.id == owner_id or user.is_admin))
+    names = api_fields(REQUEST_API_FIELDS, REQUEST_API_DEFAULT, REQUEST_API_PRIVATE, show_private)
+    return api_request_page(names, RentRequest.listing_id == id)
+
+@app.route("/api/users/<int:user_id>/requests")
+def api_user_requests(user_id):
+    user = current_user()
+    if not user:
+        raise ApiError("Login required", 401)
+    if user.id != user_id and not user.is_admin:
+        raise ApiError("Unauthorized", 403)
+    names = api_fields(REQUEST_API_FIELDS, REQUEST_API_DEFAULT)
+    return api_request_page(names, RentRequest.renter_id == user_id)
+
+@app.route("/api/export/<any(listings, requests):table>.ndjson")
+def api_export(table):
+    user = current_user()
+    if not user:
+        raise ApiError("Login required", 401)
+    if not user.is_admin:
+        raise ApiError("Access denied", 403)
+    if table == "listings":
+        names = api_fields(LISTING_API_FIELDS, LISTING_API_FIELDS)
+        statement = listings_statement(names, ["id"]).order_by(Listing.id)
+    else:
+        names = api_fields(REQUEST_API_FIELDS, REQUEST_API_FIELDS)
+        statement = api_select(REQUEST_API_FIELDS, names, ["id"]).order_by(RentRequest.id)
+    return Response(
+        stream_with_context(stream_ndjson(statement, names)),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={table}.ndjson"}
+    )
+
 # --- Misc ---
 @app.route("/about")
 def about():
     return render_template("about.html")
 
+@app.route("/metrics")
+def metrics():
+    authorized = METRICS_TOKEN and hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    )
+    if not authorized:
+        user = current_user()
+        if not (user and user.is_admin):
+            return "Unauthorized", 401
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.context_processor
 def inject_user():
-    if "user_id" in session:
-        user = User.query.get(session["user_id"])
-        return dict(user=user)
-    return dict(user=None)
+    return dict(user=current_user())
+
+# ------------------------
+# APPLICATION STARTUP
+# ------------------------
+# Routes and hooks are registered on the module-level app as this file is
+# imported; create_app() runs the one-time start-up work (schema upgrade,
+# static precompression) on top of that, so importing the module never
+# touches the database. Run under gunicorn as
+# `gunicorn --preload "app:create_app(preload=True)"`: the master does the work
+# once and forks workers that share its memory copy-on-write. The Flask CLI
+# goes through the factory too, via tools.py, which adds the developer-only
+# seed, load test and benchmark commands (FLASK_APP in .flaskenv).
+AUTO_UPGRADE_SCHEMA = os.getenv("AUTO_UPGRADE_SCHEMA", "1") == "1"
+STATIC_PRECOMPRESS = os.getenv("STATIC_PRECOMPRESS", "1") == "1"
+
+# Only the PDF and email code needs these; they are imported on first use
+DEFERRED_MODULES = (
+    "reportlab.platypus",
+    "reportlab.lib.styles",
+    "reportlab.lib.pagesizes",
+    "smtplib",
+    "email.mime.text",
+)
+
+_started = False
+_startup_lock = threading.Lock()
+
+def import_deferred_modules():
+    for name in DEFERRED_MODULES:
+        importlib.import_module(name)
+
+def create_app(preload=False):
+    """Finish starting the app and return it; later calls only apply `preload`.
+
+    preload=True also imports the deferred modules, for a preloading master
+    whose workers then share them instead of each importing its own copy.
+    """
+    global _started
+    with _startup_lock:
+        if not _started:
+            # Upgrade on startup so gunicorn workers never run against an old schema
+            if AUTO_UPGRADE_SCHEMA:
+                with app.app_context():
+                    init_db()
+                    # Pooled connections must not be inherited by forked workers
+                    db.engine.dispose()
+            if STATIC_PRECOMPRESS:
+                precompress_static_assets()
+            _started = True
+    if preload:
+        import_deferred_modules()
+    return app
 
 # ------------------------
 # RUN
 # ------------------------
 if __name__ == "__main__":
+    create_app()
     with app.app_context():
-        db.create_all()
         # print a useful DB path message
         db_path = app.config.get('SQLALCHEMY_DATABASE_URI')
         # create default admin if missing
@@ -663,7 +3508,7 @@ if __name__ == "__main__":
             admin = User(
                 username="Admin",
                 email="admin@example.com",
-                password=generate_password_hash("123"),
+                password=hash_password("123"),
                 is_admin=True
             )
             db.session.add(admin)
@@ -0,0 +1,82 @@
+"""Rendering of rental confirmation PDFs.
+
+Kept apart from app.py so the export pool's spawned renderer processes import
+only ReportLab, never the Flask app, its database or its start-up work.
+Callers pass the rows built by app.rental_pdf_rows().
+"""
+import functools
+import io
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@functools.lru_cache(maxsize=None)
+def _pdf_assets():
+    """Styles, table style and logo bytes, loaded once per process and shared by every document."""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import TableStyle
+    styles = getSampleStyleSheet()
+    table_style = TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#4CAF50")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
+        ("GRID", (0, 0), (-1, -1), 1, colors.black),
+    ])
+    logo = None
+    logo_path = os.path.join(BASE_DIR, "static", "images", "logo.png")
+    if os.path.exists(logo_path):
+        with open(logo_path, "rb") as f:
+            logo = f.read()
+    return styles, table_style, logo
+
+def _rental_pdf_elements(rows):
+    from reportlab.platypus import Image, Paragraph, Spacer, Table
+    styles, table_style, logo = _pdf_assets()
+    elements = []
+
+    # Title
+    elements.append(Paragraph("<b>Rental Confirmation</b>", styles["Title"]))
+    elements.append(Spacer(1, 20))
+
+    # Logo (optional)
+    if logo:
+        elements.append(Image(io.BytesIO(logo), width=120, height=60))
+        elements.append(Spacer(1, 20))
+
+    # Rental details
+    table = Table(rows, colWidths=[150, 350])
+    table.setStyle(table_style)
+
+    elements.append(table)
+    elements.append(Spacer(1, 30))
+
+    # Footer
+    elements.append(Paragraph(
+        "Thank you for using Rented! Please keep this document as proof of your rental agreement.",
+        styles["Normal"]
+    ))
+    return elements
+
+def build_rental_pdf(rows):
+    """Render a rental confirmation into memory and return the PDF bytes."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate
+    buf = io.BytesIO()
+    SimpleDocTemplate(buf, pagesize=letter).build(_rental_pdf_elements(rows))
+    return buf.getvalue()
+
+def build_combined_rental_pdf(rows_list):
+    """Render several confirmations as one PDF, one per page."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import PageBreak, SimpleDocTemplate
+    elements = []
+    for rows in rows_list:
+        if elements:
+            elements.append(PageBreak())
+        elements.extend(_rental_pdf_elements(rows))
+    buf = io.BytesIO()
+    SimpleDocTemplate(buf, pagesize=letter).build(elements)
+    return buf.getvalue()
@@ -0,0 +1,13 @@
+// Dropdown toggle
+document.addEventListener("DOMContentLoaded", function() {
+  const userInfo = document.querySelector(".user-info");
+  if (userInfo) {
+    const pic = userInfo.querySelector(".profile-pic");
+    const menu = userInfo.querySelector(".dropdown-menu");
+    pic.addEventListener("click", (e) => {
+      e.stopPropagation();
+      menu.classList.toggle("show");
+    });
+    window.addEventListener("click", () => menu.classList.remove("show"));
+  }
+});
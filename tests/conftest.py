@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# Configure a scratch database before the app module is imported
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp, "test.db")
+os.environ["STATIC_PRECOMPRESS"] = "0"
+os.environ["JOB_WORKER_MODE"] = "external"
+os.environ["PAGE_CACHE_BACKEND"] = "none"
+os.environ["USER_CACHE_TTL"] = "0"  # ids are reused once a test empties the tables
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as rented  # noqa: E402
+
+rented.create_app()
+
+
+@pytest.fixture
+def app():
+    rented.app.config["TESTING"] = True
+    yield rented.app
+    with rented.app.app_context():
+        for table in reversed(rented.db.metadata.sorted_tables):
+            rented.db.session.execute(table.delete())
+        rented.db.session.commit()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id):
+    with client.session_transaction() as client_session:
+        client_session["user_id"] = user_id
+
+
+@pytest.fixture
+def approved_booking(app):
+    """An owner, a renter and an approved booking for the owner's listing."""
+    with app.app_context():
+        return _add_approved_booking()
+
+
+def _add_approved_booking():
+    owner = rented.User(username="owner", email="owner@example.com", password="!")
+    renter = rented.User(username="renter", email="renter@example.com", password="!")
+    rented.db.session.add_all([owner, renter])
+    rented.db.session.flush()
+    listing = rented.Listing(title="Drill", description="Cordless", price=10, user_id=owner.id)
+    rented.db.session.add(listing)
+    rented.db.session.flush()
+    start = datetime.utcnow().date()
+    rent_request = rented.RentRequest(
+        listing_id=listing.id, renter_id=renter.id, status="Approved",
+        start_date=start, end_date=start + timedelta(days=2), days=2,
+    )
+    rented.db.session.add(rent_request)
+    rented.db.session.commit()
+    return owner.id, renter.id, rent_request.id
@@ -0,0 +1,62 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from conftest import rented
+
+THREADS = 8
+ROUNDS = 5
+REQUESTS_PER_LISTING = 4
+
+
+def _add_competing_requests():
+    owner = rented.User(username="owner", password="!")
+    renters = [rented.User(username=f"renter-{i}", password="!") for i in range(REQUESTS_PER_LISTING)]
+    rented.db.session.add_all([owner, *renters])
+    rented.db.session.flush()
+    listings = [
+        rented.Listing(title=f"Listing {i}", description="stress test", price=10, user_id=owner.id)
+        for i in range(ROUNDS)
+    ]
+    rented.db.session.add_all(listings)
+    rented.db.session.flush()
+    # Every renter wants the same day, so only one request per listing can be approved
+    today = date.today()
+    batch = [
+        rented.RentRequest(days=1, start_date=today, end_date=today + timedelta(days=1),
+                           listing_id=listing.id, renter_id=renter.id)
+        for listing in listings for renter in renters
+    ]
+    rented.db.session.add_all(batch)
+    rented.db.session.commit()
+    return owner.id, [listing.id for listing in listings], [r.id for r in batch]
+
+
+def test_concurrent_approvals_leave_one_winner(app):
+    with app.app_context():
+        owner_id, listing_ids, request_ids = _add_competing_requests()
+
+    def approve(request_id):
+        with app.test_client() as client:
+            with client.session_transaction() as client_session:
+                client_session["user_id"] = owner_id
+            return client.post(f"/approve_request/{request_id}").status_code
+
+    # Every thread approves every request once, in a different order
+    work = [rid for _ in range(THREADS) for rid in request_ids]
+    random.shuffle(work)
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        statuses = set(pool.map(approve, work))
+    assert statuses <= {302, 409}
+
+    with app.app_context():
+        approved = dict(
+            rented.db.session.query(rented.RentRequest.listing_id, rented.db.func.count())
+            .filter(rented.RentRequest.status == "Approved")
+            .group_by(rented.RentRequest.listing_id)
+        )
+        listings = rented.Listing.query.filter(rented.Listing.id.in_(listing_ids)).all()
+        daily = rented.db.session.query(rented.db.func.sum(rented.DailyRentalStats.approved)).scalar()
+    assert approved == {listing_id: 1 for listing_id in listing_ids}
+    assert all(listing.is_rented for listing in listings)
+    assert daily == ROUNDS
@@ -0,0 +1,26 @@
+import os
+
+from PIL import Image
+
+from conftest import rented
+
+
+def test_build_image_derivatives_invalidates_cached_pages(app, approved_booking, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "static_folder", str(tmp_path))
+    os.makedirs(tmp_path / "listing_images")
+    os.makedirs(tmp_path / rented.IMAGE_STORE)
+    Image.new("RGB", (64, 48), "red").save(tmp_path / "listing_images" / "drill.png")
+    with app.app_context():
+        listing = rented.Listing.query.one()
+        listing.image = "drill.png"
+        rented.db.session.commit()
+        listing_id = listing.id
+
+    result = app.test_cli_runner().invoke(args=["build-image-derivatives"])
+    assert "Converted 1 images." in result.output
+
+    with app.app_context():
+        versions = dict(rented.db.session.query(rented.ContentVersion.key, rented.ContentVersion.version))
+        assert rented.db.session.get(rented.Listing, listing_id).image.startswith("uploads/")
+    assert versions.get("feed", 0) >= 1
+    assert versions.get(f"listing:{listing_id}", 0) >= 1
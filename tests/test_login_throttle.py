@@ -0,0 +1,18 @@
+import pytest
+
+from conftest import rented
+
+
+def _login_statuses(client, attempts):
+    return [
+        client.post("/login", data={"username": f"user-{i}", "password": "wrong"}).status_code
+        for i in range(attempts)
+    ]
+
+
+@pytest.mark.parametrize("trusted_proxies, throttled", [(0, False), (1, True)])
+def test_per_ip_limit_needs_a_trusted_proxy(client, monkeypatch, trusted_proxies, throttled):
+    # Without a trusted proxy every client shares the proxy's address, so the IP bucket is skipped
+    monkeypatch.setattr(rented, "TRUSTED_PROXIES", trusted_proxies)
+    monkeypatch.setattr(rented, "login_ip_limiter", rented.TokenBucketLimiter(3, 0))
+    assert (429 in _login_statuses(client, 5)) is throttled
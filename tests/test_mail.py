@@ -0,0 +1,41 @@
+import smtplib
+
+from conftest import rented
+
+
+class FakeSMTP:
+    def __init__(self, refused):
+        self.refused = refused
+        self.delivered = []
+
+    def sendmail(self, sender, recipients, message):
+        if recipients[0] in self.refused:
+            raise smtplib.SMTPRecipientsRefused({recipients[0]: self.refused[recipients[0]]})
+        self.delivered.extend(recipients)
+
+    def quit(self):
+        pass
+
+
+def test_refused_recipient_fails_only_that_message(app, caplog):
+    server = FakeSMTP({
+        "bad@example.com": (550, b"No such user"),
+        "full@example.com": (452, b"Mailbox full"),
+    })
+    dispatcher = rented.MailDispatcher(smtp_factory=lambda: server)
+    with app.app_context():
+        for recipient in ("bad@example.com", "full@example.com", "good@example.com"):
+            rented.queue_email(recipient, "Subject", "Body")
+        rented.db.session.commit()
+
+        assert dispatcher.send_pending() == 1
+        statuses = dict(rented.db.session.query(rented.OutboxEmail.recipient, rented.OutboxEmail.status))
+
+    assert server.delivered == ["good@example.com"]
+    assert statuses == {
+        "bad@example.com": "failed",  # 5xx: never retried
+        "full@example.com": "pending",  # 4xx: retried later
+        "good@example.com": "sent",
+    }
+    failures = [r for r in caplog.records if r.levelname == "WARNING" and r.exc_info]
+    assert len(failures) == 2
@@ -0,0 +1,23 @@
+from conftest import login, rented
+
+
+def test_metrics_need_a_token_or_an_admin(client, approved_booking, monkeypatch):
+    owner_id, _, _ = approved_booking
+    assert client.get("/metrics").status_code == 401
+
+    monkeypatch.setattr(rented, "METRICS_TOKEN", "secret")
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
+
+    login(client, owner_id)
+    assert client.get("/metrics").status_code == 401
+
+
+def test_admin_can_read_metrics(app, client):
+    with app.app_context():
+        admin = rented.User(username="admin", password="!", is_admin=True)
+        rented.db.session.add(admin)
+        rented.db.session.commit()
+        admin_id = admin.id
+    login(client, admin_id)
+    assert client.get("/metrics").status_code == 200
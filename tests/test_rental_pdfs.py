@@ -0,0 +1,44 @@
+from datetime import date, timedelta
+
+from conftest import login, rented
+
+
+def test_owner_pdfs_after_renter_deletes_account(client, approved_booking):
+    owner_id, renter_id, request_id = approved_booking
+
+    login(client, renter_id)
+    assert client.post("/delete-account").status_code == 302
+
+    login(client, owner_id)
+    response = client.get(f"/request_pdf/{request_id}")
+    assert response.status_code == 200
+    assert response.data.startswith(b"%PDF-")
+
+    response = client.get("/export_pdfs?format=pdf")
+    assert response.status_code == 200
+    assert response.data.startswith(b"%PDF-")
+
+
+def test_export_filters_on_booked_dates(client, approved_booking):
+    owner_id, _, _ = approved_booking
+    login(client, owner_id)
+    today = date.today()
+
+    # Booked today..today+2; a range inside the stay matches even though the request was made today
+    inside = (today + timedelta(days=1)).isoformat()
+    response = client.get(f"/export_pdfs?format=pdf&start={inside}&end={inside}")
+    assert response.status_code == 200
+
+    after = (today + timedelta(days=2)).isoformat()
+    assert client.get(f"/export_pdfs?format=pdf&start={after}").status_code == 302
+
+
+def test_combined_pdf_is_capped(client, approved_booking, monkeypatch):
+    owner_id, _, _ = approved_booking
+    login(client, owner_id)
+    monkeypatch.setattr(rented, "EXPORT_PDF_MAX_DOCUMENTS", 0)
+
+    assert client.get("/export_pdfs?format=pdf").status_code == 302
+    response = client.get("/export_pdfs")
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
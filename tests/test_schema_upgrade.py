@@ -0,0 +1,32 @@
+import pytest
+
+from conftest import rented
+
+
+def test_failed_foreign_key_rebuild_restores_the_pragma(app, monkeypatch):
+    connections = []
+
+    def fail_rebuild(conn, tables):
+        connections.append(conn.connection.dbapi_connection)
+        raise RuntimeError("rebuild failed")
+
+    monkeypatch.setattr(rented, "_stale_foreign_keys", lambda inspector: [("listing", None, None)])
+    monkeypatch.setattr(rented, "_rebuild_sqlite_tables", fail_rebuild)
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            rented.upgrade_foreign_keys()
+
+    # The pooled connection must come back with ON DELETE CASCADE enforced
+    assert connections[0].execute("PRAGMA foreign_keys").fetchone() == (1,)
+
+
+def test_rebuild_logs_the_orphans_it_removes(app, caplog):
+    with app.app_context(), rented.db.engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+        conn.exec_driver_sql(
+            "INSERT INTO listing (title, description, price, user_id) VALUES ('Orphan', 'x', 1, 999)"
+        )
+        rented._rebuild_sqlite_tables(conn, [])
+        conn.rollback()
+        conn.exec_driver_sql("PRAGMA foreign_keys = ON")
+    assert "1 listings deleted, 0 rent requests deleted, 0 renters cleared" in caplog.text
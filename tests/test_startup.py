@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+
+def test_import_does_not_touch_the_database(tmp_path):
+    database = tmp_path / "untouched.db"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}")
+    subprocess.run(
+        [sys.executable, "-c", "import app"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env, check=True
+    )
+    assert not database.exists()
@@ -0,0 +1,8 @@
+from flask import url_for
+
+
+def test_derivative_urls_are_not_fingerprinted(app):
+    with app.test_request_context():
+        for variant in ("0123456789abcdef_thumb.webp", "0123456789abcdef_card.jpg", "0123456789abcdef_full.png"):
+            assert "?v=" not in url_for("static", filename=f"uploads/{variant}")
+        assert "?v=" in url_for("static", filename="css/base.css")
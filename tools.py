@@ -0,0 +1,489 @@
+"""Developer CLI commands: synthetic data, load testing and benchmarks.
+
+They register on app.cli when this module is imported. Only the Flask CLI
+imports it (FLASK_APP in .flaskenv), so gunicorn workers never load them.
+"""
+import itertools
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+
+from app import (
+    app, create_app, db, User, Listing, RentRequest, BASE_DIR, FEED_PAGE_SIZE,
+    SQLITE_BUSY_TIMEOUT_MS, DB_POOL_SIZE, DB_MAX_OVERFLOW, hash_password, bump_versions,
+    login_ip_limiter, login_user_limiter, rebuild_search_index_command, rebuild_rental_stats_command,
+)
+
+__all__ = ["create_app"]  # the Flask CLI entry point
+
+# ------------------------
+# SEED DATA AND LOAD TESTING
+# ------------------------
+# `flask seed` fills a scratch database with production-sized data and
+# `flask loadtest` drives the real routes against it. Never point either at
+# the production DATABASE_URL.
+SEED_PASSWORD = "password"  # every seeded user can log in with it
+SEED_ITEMS = ["bike", "camera", "drone", "tent", "kayak", "projector", "guitar", "car", "scooter",
+              "laptop", "speaker", "ladder", "drill", "console", "lens", "surfboard", "van", "generator"]
+SEED_ADJECTIVES = ["red", "compact", "vintage", "electric", "professional", "lightweight", "waterproof",
+                   "4K", "family", "heavy-duty", "portable", "wireless", "classic", "folding"]
+SEED_PLACES = ["Kuala Lumpur", "Penang", "Johor Bahru", "Ipoh", "Melaka", "Kota Kinabalu", "Kuching",
+               "Shah Alam", "Cyberjaya", "Putrajaya"]
+
+def _bulk_insert(model, rows, batch_size):
+    """Insert row dicts through the model in executemany batches; returns the count."""
+    total = 0
+    for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+        db.session.execute(db.insert(model), batch)
+        total += len(batch)
+    return total
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+@app.cli.command("seed")
+@click.option("--users", default=10000, help="Users to create.")
+@click.option("--listings", default=200000, help="Listings to create.")
+@click.option("--requests", "request_count", default=2000000, help="Rent requests to create.")
+@click.option("--rented", default=0.3, help="Share of listings with an approved booking covering today.")
+@click.option("--days", default=365, help="Spread created_at over this many past days.")
+@click.option("--batch-size", default=10000, help="Rows per INSERT batch.")
+@click.option("--seed", "random_seed", default=42, help="Random seed, for repeatable datasets.")
+@click.pass_context
+def seed_command(ctx, users, listings, request_count, rented, days, batch_size, random_seed):
+    """Generate a large synthetic dataset with bulk inserts."""
+    rng = random.Random(random_seed)
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    password = hash_password(SEED_PASSWORD)  # hashed once, shared by every seeded user
+    tag = uuid.uuid4().hex[:6]
+
+    def moment():
+        return now - timedelta(seconds=rng.randrange(days * 86400))
+
+    # Explicit ids so listings and requests can reference rows without reading them back
+    first_user, first_listing, first_request = _next_id(User), _next_id(Listing), _next_id(RentRequest)
+    user_ids = range(first_user, first_user + users)
+    inserted_users = _bulk_insert(User, (
+        {"id": user_id, "username": f"seed_{tag}_{user_id}", "email": f"seed_{tag}_{user_id}@example.com",
+         "password": password, "created_at": moment()}
+        for user_id in user_ids
+    ), batch_size)
+
+    owners = [rng.choice(user_ids) for _ in range(listings)]
+    prices = [float(rng.randrange(5, 500)) for _ in range(listings)]
+    is_rented = [rng.random() < rented for _ in range(listings)]
+
+    def listing_rows():
+        for i in range(listings):
+            item = rng.choice(SEED_ITEMS)
+            yield {
+                "id": first_listing + i,
+                "title": f"{rng.choice(SEED_ADJECTIVES).capitalize()} {item}",
+                "description": f"{rng.choice(SEED_ADJECTIVES).capitalize()} {item} for rent in "
+                               f"{rng.choice(SEED_PLACES)}. Well looked after, pick up or delivery.",
+                "price": prices[i],
+                "image": "default_listing.png",
+                "user_id": owners[i],
+                "created_at": moment(),
+                "is_rented": is_rented[i],
+            }
+    inserted_listings = _bulk_insert(Listing, listing_rows(), batch_size)
+
+    def request_rows():
+        # Spread requests evenly; rented listings approve their first one, covering
+        # today, and decline the rest
+        per_listing, extra = divmod(request_count, listings) if listings else (0, 0)
+        request_id = first_request
+        today = now.date()
+        for i in range(listings):
+            count = min(per_listing + (i < extra), users - 1)
+            renters = [r for r in rng.sample(user_ids, min(count + 1, users)) if r != owners[i]][:count]
+            for n, renter_id in enumerate(renters):
+                length = rng.randrange(1, 15)
+                if is_rented[i] and n == 0:
+                    status = "Approved"
+                    start_date = today - timedelta(days=rng.randrange(length))
+                else:
+                    status = "Declined" if is_rented[i] else rng.choice(("Pending", "Pending", "Pending", "Declined"))
+                    start_date = today + timedelta(days=rng.randrange(-30, 60))
+                yield {
+                    "id": request_id,
+                    "start_date": start_date,
+                    "end_date": start_date + timedelta(days=length),
+                    "days": length,
+                    "description": f"01{rng.randrange(10000000, 99999999)}",
+                    "status": status,
+                    "created_at": moment(),
+                    "listing_id": first_listing + i,
+                    "renter_id": renter_id,
+                }
+                request_id += 1
+    inserted_requests = _bulk_insert(RentRequest, request_rows(), batch_size)
+
+    if db.engine.dialect.name == "postgresql":
+        # Explicit ids do not advance the serial sequences
+        for model in (User, Listing, RentRequest):
+            table_name = model.__table__.name
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table_name}\"', 'id'), "
+                f"(SELECT MAX(id) FROM \"{table_name}\"))"
+            ))
+    bump_versions("feed", "profiles")
+    db.session.commit()
+    print(f"Inserted {inserted_users} users, {inserted_listings} listings and {inserted_requests} requests "
+          f"in {time.perf_counter() - start:.1f}s (password for every seeded user: {SEED_PASSWORD!r}).")
+    ctx.invoke(rebuild_search_index_command)
+    ctx.invoke(rebuild_rental_stats_command)
+
+LOAD_MIX = {"home": 30, "listing": 30, "login": 10, "request": 15, "approve": 10, "pdf": 5}
+
+class _TestClientDriver:
+    """Runs load-test requests in-process through the Flask test client."""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def as_user(self, user_id, username):
+        with self.client.session_transaction() as client_session:
+            client_session.clear()
+            client_session["user_id"] = user_id
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+class _HttpDriver:
+    """Runs load-test requests against a live server, e.g. a local gunicorn."""
+
+    def __init__(self, base_url):
+        import http.cookiejar
+        import urllib.request
+
+        class NoRedirect(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kwargs):
+                return None
+
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect
+        )
+
+    def as_user(self, user_id, username):
+        self.request("POST", "/login", {"username": username, "password": SEED_PASSWORD})
+
+    def request(self, method, path, data=None):
+        import urllib.error
+        import urllib.parse
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base_url + path, data=body if method == "POST" else None) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+@app.cli.command("loadtest")
+@click.option("--requests", "total", default=1000, help="Requests to send in total.")
+@click.option("--concurrency", default=8, help="Concurrent virtual users (threads).")
+@click.option("--url", default=None, help="Base URL of a running server; default is in-process.")
+def loadtest_command(total, concurrency, url):
+    """Drive the main routes with a mixed workload and report latency percentiles."""
+    # Pools of real ids to aim at, sampled once up front
+    sample = lambda query: query.order_by(db.func.random()).limit(2000).all()
+    listing_ids = [lid for (lid,) in sample(db.session.query(Listing.id).filter(Listing.is_rented.is_(False)))]
+    users = sample(db.session.query(User.id, User.username).filter(User.username.like("seed\\_%", escape="\\")))
+    pending = sample(
+        db.session.query(RentRequest.id, User.id, User.username)
+        .join(Listing, RentRequest.listing_id == Listing.id).join(User, Listing.user_id == User.id)
+        .filter(RentRequest.status == "Pending", User.username.like("seed\\_%", escape="\\"))
+    )
+    approved = sample(
+        db.session.query(RentRequest.id, User.id, User.username)
+        .join(Listing, RentRequest.listing_id == Listing.id).join(User, Listing.user_id == User.id)
+        .filter(RentRequest.status == "Approved", User.username.like("seed\\_%", escape="\\"))
+    )
+    db.session.remove()
+    if not (listing_ids and users):
+        raise click.ClickException("No seeded data found; run `flask seed` first.")
+
+    if url is None:
+        # One client address for every virtual user; lift the throttle so logins are measured
+        login_ip_limiter.burst = login_user_limiter.burst = float("inf")
+
+    query_counter = threading.local()
+
+    def load_booking():
+        start_date = datetime.utcnow().date() + timedelta(days=random.randrange(1, 180))
+        end_date = start_date + timedelta(days=random.randrange(1, 10))
+        return {"start_date": start_date.isoformat(), "end_date": end_date.isoformat(), "description": "load test"}
+
+    def count_query(*args):
+        query_counter.count = getattr(query_counter, "count", 0) + 1
+
+    operations = {
+        "home": lambda d: d.request("GET", "/"),
+        "listing": lambda d: d.request("GET", f"/listing/{random.choice(listing_ids)}"),
+        "login": lambda d: d.request("POST", "/login", {
+            "username": random.choice(users).username, "password": SEED_PASSWORD
+        }),
+        "request": lambda d: d.request("POST", f"/listing/{random.choice(listing_ids)}", load_booking()),
+        "approve": lambda d: d.request("POST", f"/approve_request/{d.target[0]}"),
+        "pdf": lambda d: d.request("GET", f"/request_pdf/{d.target[0]}"),
+    }
+    targets = {"approve": pending, "pdf": approved}
+    mix = [name for name in LOAD_MIX if name not in targets or targets[name]]
+    results = []  # (operation, seconds, status, queries)
+    results_lock = threading.Lock()
+    remaining = itertools.count()
+
+    def virtual_user(_):
+        driver = _HttpDriver(url) if url else _TestClientDriver()
+        user = random.choice(users)
+        driver.as_user(user.id, user.username)
+        while next(remaining) < total:
+            name = random.choices(mix, weights=[LOAD_MIX[m] for m in mix])[0]
+            if name in targets:
+                # Act as the listing owner, then switch back
+                driver.target = random.choice(targets[name])
+                driver.as_user(driver.target[1], driver.target[2])
+            query_counter.count = 0
+            started = time.perf_counter()
+            try:
+                status = operations[name](driver)
+            except Exception as e:
+                print(f"{name} failed: {e}")
+                status = 599
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                results.append((name, elapsed, status, query_counter.count))
+            if name in targets or name == "login":
+                driver.as_user(user.id, user.username)
+
+    if url is None:
+        event.listen(db.engine, "before_cursor_execute", count_query)
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(virtual_user, range(concurrency)))
+    finally:
+        if url is None:
+            event.remove(db.engine, "before_cursor_execute", count_query)
+    wall = time.perf_counter() - started
+
+    print(f"{len(results)} requests, {concurrency} virtual users, {wall:.1f}s, {len(results) / wall:.1f} req/s")
+    print(f"{'operation':<10} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'queries':>8}")
+    groups = {}
+    for name, elapsed, status, queries in results:
+        groups.setdefault(name, []).append((elapsed, status, queries))
+    groups["all"] = [(elapsed, status, queries) for _, elapsed, status, queries in results]
+    for name, rows in groups.items():
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in rows)
+        errors = sum(1 for _, status, _ in rows if status >= 500)
+        queries = f"{sum(q for _, _, q in rows) / len(rows):.1f}" if url is None else "n/a"
+        print(f"{name:<10} {len(rows):>6} {_percentile(latencies, 50):>8.1f} {_percentile(latencies, 95):>8.1f} "
+              f"{_percentile(latencies, 99):>8.1f} {errors:>7} {queries:>8}")
+
+DB_BENCH_MARKER = "db benchmark"  # description of the rent requests the benchmark writes
+
+def _db_bench_worker(seconds, write_percent, listing_ids, renter_ids, seed):
+    """One benchmark process: mix feed reads and rent request inserts until the deadline."""
+    rng = random.Random(seed)
+    counts = {"read": 0, "write": 0, "error": 0}
+    latencies = {"read": [], "write": []}
+    inserted = []
+    with app.app_context():
+        db.engine.dispose(close=False)  # forked: open our own connections, leave the parent's alone
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            kind = "write" if rng.random() * 100 < write_percent else "read"
+            started = time.perf_counter()
+            try:
+                if kind == "write":
+                    start_date = datetime.utcnow().date() + timedelta(days=rng.randrange(1, 180))
+                    days = rng.randrange(1, 10)
+                    rent_request = RentRequest(
+                        listing_id=rng.choice(listing_ids), renter_id=rng.choice(renter_ids),
+                        start_date=start_date, end_date=start_date + timedelta(days=days), days=days,
+                        description=DB_BENCH_MARKER
+                    )
+                    db.session.add(rent_request)
+                    db.session.commit()
+                    inserted.append(rent_request.id)
+                else:
+                    Listing.query.options(joinedload(Listing.user)).order_by(
+                        Listing.created_at.desc(), Listing.id.desc()
+                    ).limit(FEED_PAGE_SIZE).all()
+                    db.session.rollback()  # end the read transaction, as a request would
+            except OperationalError:
+                # Lock or statement timeout
+                db.session.rollback()
+                counts["error"] += 1
+                continue
+            latencies[kind].append(time.perf_counter() - started)
+            counts[kind] += 1
+        db.session.remove()
+    return counts, latencies, inserted
+
+@app.cli.command("bench-db")
+@click.option("--processes", default=4, help="Concurrent worker processes, like gunicorn workers.")
+@click.option("--seconds", default=5.0, help="How long each process runs.")
+@click.option("--write-percent", default=20, help="Share of operations that insert a rent request.")
+def bench_db_command(processes, seconds, write_percent):
+    """Measure read/write throughput of the configured engine across several processes.
+
+    Compare profiles by re-running with e.g. SQLITE_JOURNAL_MODE=DELETE
+    SQLITE_SYNCHRONOUS=FULL. The rows written are deleted afterwards.
+    """
+    listing_ids = [lid for (lid,) in db.session.query(Listing.id).limit(2000)]
+    renter_ids = [uid for (uid,) in db.session.query(User.id).limit(2000)]
+    if not (listing_ids and renter_ids):
+        raise click.ClickException("No listings found; run `flask seed` first.")
+    with db.engine.connect() as connection:
+        if connection.dialect.name == "sqlite":
+            journal = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+            synchronous = connection.exec_driver_sql("PRAGMA synchronous").scalar()
+            print(f"SQLite journal_mode={journal} synchronous={synchronous} busy_timeout={SQLITE_BUSY_TIMEOUT_MS}ms")
+        else:
+            print(f"{connection.dialect.name} pool_size={DB_POOL_SIZE} max_overflow={DB_MAX_OVERFLOW}")
+    db.session.remove()
+    db.engine.dispose()
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [
+            pool.submit(_db_bench_worker, seconds, write_percent, listing_ids, renter_ids, seed)
+            for seed in range(processes)
+        ]
+        results = [future.result() for future in futures]
+
+    counts = {kind: sum(r[0][kind] for r in results) for kind in ("read", "write", "error")}
+    print(f"{processes} processes, {seconds:g}s, {write_percent}% writes")
+    print(f"{'operation':<10} {'count':>7} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for kind in ("read", "write"):
+        latencies = sorted(ms * 1000 for r in results for ms in r[1][kind])
+        print(f"{kind:<10} {counts[kind]:>7} {counts[kind] / seconds:>8.1f} {_percentile(latencies, 50):>8.1f} "
+              f"{_percentile(latencies, 95):>8.1f} {_percentile(latencies, 99):>8.1f}")
+    print(f"{counts['error']} operations failed on a lock or statement timeout.")
+
+    inserted = [rid for r in results for rid in r[2]]
+    for start in range(0, len(inserted), 500):
+        RentRequest.query.filter(RentRequest.id.in_(inserted[start:start + 500])).delete(synchronize_session=False)
+    db.session.commit()
+
+# ------------------------
+# STARTUP BENCHMARK
+# ------------------------
+STARTUP_PROBE = """
+import resource, sys, time
+start = time.perf_counter()
+import app
+app.create_app(preload=sys.argv[1] == "eager")
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+def _process_memory(pid):
+    """(RSS, PSS) of a process in MB; PSS splits shared pages between the processes using them."""
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                memory[key] = int(value.split()[0]) / 1024
+    return memory["Rss"], memory["Pss"]
+
+def _child_pids(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the parent pid follows the closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+def _measure_gunicorn(workers, preload, timeout=60):
+    """Start gunicorn, wait until every worker answers, and return (seconds to ready, [(rss, pss)])."""
+    import socket
+    import urllib.request
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    target = "app:create_app(preload=True)" if preload else "app:create_app()"
+    command = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "--log-level", "warning"]
+    if preload:
+        command.append("--preload")
+    started = time.perf_counter()
+    server = subprocess.Popen(command + [target], cwd=BASE_DIR)
+    try:
+        while True:
+            if server.poll() is not None or time.perf_counter() - started > timeout:
+                raise click.ClickException(f"gunicorn did not start (exit code {server.returncode}).")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/about", timeout=5):
+                    pass
+            except OSError:
+                time.sleep(0.1)
+                continue
+            if len(_child_pids(server.pid)) >= workers:
+                break
+        ready = time.perf_counter() - started
+        # Let every worker serve a few pages so the numbers include a warm worker
+        for _ in range(workers * 5):
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=10):
+                pass
+        return ready, [_process_memory(pid) for pid in _child_pids(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+
+@app.cli.command("bench-startup")
+@click.option("--runs", default=5, help="Fresh interpreters to time per import mode.")
+@click.option("--workers", default=2, help="Gunicorn workers to start; 0 skips the gunicorn runs.")
+def bench_startup_command(runs, workers):
+    """Report import time and per-worker memory, with and without deferred imports and --preload."""
+    print(f"{'import':<10} {'median s':>9} {'max RSS MB':>11}")
+    for mode in ("deferred", "eager"):
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_PROBE, mode],
+                cwd=BASE_DIR, capture_output=True, text=True, check=True
+            ).stdout.split()
+            samples.append((float(output[-2]), int(output[-1]) / 1024))
+        print(f"{mode:<10} {statistics.median(s[0] for s in samples):>9.3f} "
+              f"{max(s[1] for s in samples):>11.1f}")
+
+    if not workers:
+        return
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("Skipping gunicorn runs: per-process memory needs Linux /proc.")
+        return
+    print()
+    print(f"{'gunicorn':<10} {'ready s':>9} {'RSS/worker':>11} {'PSS/worker':>11}")
+    for preload in (False, True):
+        ready, memory = _measure_gunicorn(workers, preload)
+        print(f"{'--preload' if preload else 'default':<10} {ready:>9.2f} "
+              f"{statistics.mean(m[0] for m in memory):>11.1f} {statistics.mean(m[1] for m in memory):>11.1f}")